@@ -0,0 +1,123 @@
+"""
+Import-time report for the app modules and pages.
+Each module is imported in a fresh interpreter with `python -X importtime`, so the numbers match a cold start of the
+app process. The report lists the total import cost of each module and the heaviest top-level packages it pulls in,
+so a new module-level import of a large SDK shows up before it reaches App Service.
+Usage:
+    python benchmarks/import_times.py
+    python benchmarks/import_times.py --modules Home openai_connection --top 5 --max-ms 1500
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+SRC_FOLDER = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+DEFAULT_MODULES = ["cache", "metrics", "rate_limiter", "utils", "openai_connection", "extraction"]
+
+
+def page_modules():
+    """
+    Returns the Streamlit entry point and pages as paths relative to src/, in the order Streamlit lists them.
+    """
+
+    pages = sorted(glob.glob(os.path.join(SRC_FOLDER, "pages", "*.py")))
+    return ["Home.py"] + [os.path.relpath(page, SRC_FOLDER) for page in pages]
+
+
+def measure(target):
+    """
+    Imports a module (or executes a page script) in a fresh interpreter and parses the -X importtime output.
+    Args:
+        target (str): A module name, or the path of a page script relative to src/.
+    Returns:
+        dict: 'total_ms', the import cost of the target including everything it imports (less the cost of starting a
+              bare interpreter), and 'packages', the
+              cumulative import cost in milliseconds of each top-level package imported while loading it.
+    Notes:
+        - Page scripts are executed with runpy in bare mode, so Streamlit calls return immediately and the report
+          covers the imports a cold first render of the page pays for.
+        - The interpreter runs in a temporary folder so folders the pages create (prompt/, uploaded_files/...) don't
+          end up in src/.
+        - Dummy OpenAI settings are used so modules that read them at import time can load without a .env file.
+    """
+
+    if target.endswith(".py"):
+        code = f"import runpy; runpy.run_path({os.path.join(SRC_FOLDER, target)!r}, run_name='__main__')"
+    else:
+        code = f"import {target}"
+    env = dict(os.environ, PYTHONPATH=SRC_FOLDER, OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "import-times"),
+               OPENAI_API_ENDPOINT=os.getenv("OPENAI_API_ENDPOINT", "http://127.0.0.1:1"))
+    baseline, baseline_total = _run_importtime("pass", env)
+    imports, total = _run_importtime(code, env)
+    total = max(0, total - baseline_total)
+
+    # Top-level packages only (their times include their submodules), leaving out the target itself and what a bare
+    # interpreter already loads
+    packages = {
+        name: round(cumulative / 1000, 1) for name, cumulative in imports.items()
+        if "." not in name and name not in baseline and name != target
+    }
+    return {"total_ms": round(total / 1000, 1), "packages": packages}
+
+
+def _run_importtime(code, env):
+    """
+    Returns the cumulative microseconds of each imported module, and the total of the outermost imports.
+    """
+
+    with tempfile.TemporaryDirectory() as workdir:
+        completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=workdir, env=env,
+                                   capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Running {code!r} failed:\n{completed.stderr[-2000:]}")
+
+    cumulative = {}
+    total = 0
+    for line in completed.stderr.splitlines():
+        # Lines look like "import time:       123 |       4567 |     package.module", indented two spaces per level
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, _, fields = line.partition(":")
+        _, microseconds, name = fields.split("|")
+        microseconds = int(microseconds)
+        if len(name) - len(name.lstrip()) == 1:
+            # Outermost imports don't overlap, so their sum is the whole import cost
+            total += microseconds
+        name = name.strip()
+        cumulative[name] = max(cumulative.get(name, 0), microseconds)
+    return cumulative, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the cold-start import cost of the app modules and pages.")
+    parser.add_argument("--modules", nargs="+", help="Modules or page paths (relative to src/) to measure. Defaults to all modules and pages.")
+    parser.add_argument("--top", type=int, default=3, help="Heaviest packages to list per module.")
+    parser.add_argument("--max-ms", type=float, help="Exit with status 1 if any module takes longer than this to import.")
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+
+    targets = args.modules or DEFAULT_MODULES + page_modules()
+    results = {}
+    for target in targets:
+        results[target] = measure(target)
+        heaviest = sorted(results[target]["packages"].items(), key=lambda item: item[1], reverse=True)[:args.top]
+        details = ", ".join(f"{name} {ms:.0f}ms" for name, ms in heaviest)
+        print(f"{target:<32} {results[target]['total_ms']:8.1f} ms   {details}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.max_ms is not None:
+        slow = [target for target, result in results.items() if result["total_ms"] > args.max_ms]
+        if slow:
+            print(f"Over the {args.max_ms:.0f} ms budget: {', '.join(slow)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
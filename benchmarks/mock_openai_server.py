@@ -0,0 +1,183 @@
+"""
+A local stand-in for the Azure OpenAI chat completions endpoint, used by the benchmarks.
+It answers any POST to '.../chat/completions' with a synthetic completion after a configurable delay, supports streamed
+responses, can inject 429 responses with a Retry-After header, and counts requests and bytes received.
+Usage:
+    python benchmarks/mock_openai_server.py --port 8765 --latency 0.2 --tokens-per-second 50 --rate-limit-fraction 0.05
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockSettings:
+    """
+    Behaviour of the mock server. Attributes can be changed while it is running.
+    Args:
+        latency (float): Seconds before the first token of every response.
+        tokens_per_second (float): Generation speed used to pace the rest of the response.
+        completion_tokens (int): The approximate length of each completion.
+        rate_limit_fraction (float): The fraction of requests answered with 429.
+        retry_after (float): The Retry-After value sent with injected 429 responses.
+    """
+
+    def __init__(self, latency=0.05, tokens_per_second=2000, completion_tokens=200, rate_limit_fraction=0.0, retry_after=0.1):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.rate_limit_fraction = rate_limit_fraction
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.requests = 0
+        self.rate_limited = 0
+        self.bytes_received = 0
+        self.prompt_tokens = 0
+        self.completion_tokens_sent = 0
+
+
+def _completion_text(body, settings):
+    messages = body.get("messages", [])
+    if body.get("response_format", {}).get("type") == "json_object":
+        system = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+        if '"updates"' in system:
+            # InfoGather patch mode
+            return json.dumps({
+                "message_to_user": "Thanks! Could you tell me a little more?",
+                "updates": [{"op": "replace", "path": "/personal_info/full_name", "value": "Test User"}],
+            })
+        return json.dumps({
+            "message_to_user": "Thanks! Could you tell me a little more?",
+            "updated_json": {"personal_info": {"full_name": "Test User"}},
+        })
+
+    last = messages[-1]["content"] if messages else ""
+    if isinstance(last, list):
+        # Vision request: return a page of markdown with a table
+        rows = "\n".join(f"| Item {row} | {row * 10} | note {row} |" for row in range(max(1, settings.completion_tokens // 20)))
+        return f"Page 1\n\nExtracted content\n| Item | Value | Details |\n| ---- | ----- | ------- |\n{rows}\n"
+
+    words = max(1, int(settings.completion_tokens * 0.75))
+    return " ".join(random.choice(["policy", "cover", "premium", "claim", "excess", "term", "insured", "date"]) for _ in range(words))
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    settings = MockSettings()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+        settings = self.settings
+        with settings.lock:
+            settings.requests += 1
+            settings.bytes_received += len(raw) + sum(len(key) + len(value) + 4 for key, value in self.headers.items())
+
+        if not self.path.split("?")[0].endswith("/chat/completions"):
+            self.send_error(404)
+            return
+
+        if random.random() < settings.rate_limit_fraction:
+            with settings.lock:
+                settings.rate_limited += 1
+            payload = json.dumps({"error": {"code": "429", "message": "Rate limit is exceeded."}}).encode("utf-8")
+            self.send_response(429)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Retry-After", str(settings.retry_after))
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        body = json.loads(raw or b"{}")
+        text = _completion_text(body, settings)
+        completion_tokens = max(1, len(text) // 4)
+        prompt_tokens = max(1, len(raw) // 4)
+        with settings.lock:
+            settings.prompt_tokens += prompt_tokens
+            settings.completion_tokens_sent += completion_tokens
+
+        time.sleep(settings.latency)
+        if body.get("stream"):
+            self._send_stream(body, text, completion_tokens)
+        else:
+            time.sleep(completion_tokens / settings.tokens_per_second)
+            self._send_json(body, text, prompt_tokens, completion_tokens)
+
+    def _send_json(self, body, text, prompt_tokens, completion_tokens):
+        payload = json.dumps({
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_stream(self, body, text, completion_tokens):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        pieces = [text[start:start + 16] for start in range(0, len(text), 16)]
+        delay = completion_tokens / self.settings.tokens_per_second / max(1, len(pieces))
+        for piece in pieces:
+            chunk = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "gpt-4o"),
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(delay)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_server(settings, port=0):
+    """
+    Starts the mock server on a background thread.
+    Args:
+        settings (MockSettings): The behaviour of the server.
+        port (int, optional): The port to listen on. Defaults to 0 (any free port).
+    Returns:
+        ThreadingHTTPServer: The running server. Its endpoint is http://127.0.0.1:<server.server_address[1]>.
+    """
+
+    handler = type("ConfiguredMockHandler", (MockHandler,), {"settings": settings})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a mock Azure OpenAI chat completions endpoint.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds before the first token.")
+    parser.add_argument("--tokens-per-second", type=float, default=2000)
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    parser.add_argument("--rate-limit-fraction", type=float, default=0.0, help="Fraction of requests answered with 429.")
+    parser.add_argument("--retry-after", type=float, default=0.1)
+    args = parser.parse_args()
+
+    settings = MockSettings(args.latency, args.tokens_per_second, args.completion_tokens, args.rate_limit_fraction, args.retry_after)
+    server = start_server(settings, args.port)
+    print(f"Mock OpenAI endpoint listening on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
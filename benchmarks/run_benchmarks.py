@@ -0,0 +1,179 @@
+"""
+Offline benchmarks for the document pipeline and model call paths.
+Starts the mock chat completions server, points the app modules in src/ at it and runs the real code paths:
+PDF rendering and extraction (fixed, adaptive and text layer with local tables), summarization, comparison and InfoGather chat turns, on generated fixture PDFs.
+For each scenario it reports wall-clock time, throughput, requests, injected 429s and bytes sent to the model endpoint.
+No network access or API key is needed and no tokens are spent.
+Usage:
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --pages 1 20 --latency 0.5 --rate-limit-fraction 0.1 --json results.json
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import fitz
+
+from mock_openai_server import MockSettings, start_server
+
+SRC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+
+def make_fixture_pdf(path, pages):
+    """
+    Writes a PDF with the given number of pages, each with a heading, a paragraph and a small table.
+    Args:
+        path (str): Where to write the PDF.
+        pages (int): The number of pages.
+    """
+
+    document = fitz.open()
+    for number in range(1, pages + 1):
+        page = document.new_page()
+        page.insert_text((72, 72), f"Section {number}: Policy wording", fontsize=16)
+        page.insert_textbox(
+            fitz.Rect(72, 90, 520, 200),
+            "The insurer will cover loss or damage to the buildings caused by fire, flood, storm or theft, "
+            "subject to the excess and the conditions set out in this schedule. " * 2,
+            fontsize=10,
+        )
+        for row in range(6):
+            for column in range(3):
+                rect = fitz.Rect(72 + column * 140, 220 + row * 20, 212 + column * 140, 240 + row * 20)
+                page.draw_rect(rect, width=0.5)
+                page.insert_text((rect.x0 + 4, rect.y1 - 6), f"R{row}C{column} {number * row}", fontsize=9)
+    document.save(path)
+    document.close()
+
+
+class Benchmark:
+    """
+    Runs scenarios against the mock server and collects one result row per scenario.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.results = []
+
+    def run(self, name, func, items):
+        """
+        Runs a scenario and records its timings and the traffic the mock server saw.
+        Args:
+            name (str): The scenario name.
+            func (callable): The scenario, called with no arguments.
+            items (int): The number of units of work (pages, turns...) used to compute throughput.
+        Returns:
+            The value returned by func.
+        """
+
+        self.settings.reset_counters()
+        started = time.perf_counter()
+        value = func()
+        wall = time.perf_counter() - started
+        self.results.append({
+            "scenario": name,
+            "wall_seconds": round(wall, 3),
+            "items": items,
+            "items_per_second": round(items / wall, 2) if wall else None,
+            "requests": self.settings.requests,
+            "rate_limited": self.settings.rate_limited,
+            "bytes_sent": self.settings.bytes_received,
+            "prompt_tokens": self.settings.prompt_tokens,
+            "completion_tokens": self.settings.completion_tokens_sent,
+        })
+        print(f"{name:<28} {wall:8.2f}s  {self.settings.requests:5d} requests  {self.settings.bytes_received / 1e6:8.2f} MB sent", file=sys.stderr)
+        return value
+
+
+def print_table(results):
+    columns = ["scenario", "wall_seconds", "items", "items_per_second", "requests", "rate_limited", "bytes_sent", "prompt_tokens", "completion_tokens"]
+    widths = {column: max(len(column), *(len(str(row[column])) for row in results)) for column in columns}
+    print("  ".join(column.ljust(widths[column]) for column in columns))
+    for row in results:
+        print("  ".join(str(row[column]).ljust(widths[column]) for column in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the document pipeline against a local mock model endpoint.")
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 20, 200], help="Fixture PDF sizes to run.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock seconds to first token.")
+    parser.add_argument("--tokens-per-second", type=float, default=2000, help="Mock generation speed.")
+    parser.add_argument("--completion-tokens", type=int, default=200, help="Mock completion length.")
+    parser.add_argument("--rate-limit-fraction", type=float, default=0.0, help="Fraction of requests answered with 429.")
+    parser.add_argument("--concurrency", type=int, default=4, help="OPENAI_MAX_CONCURRENCY for the app modules.")
+    parser.add_argument("--chat-turns", type=int, default=10, help="InfoGather turns to run.")
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+
+    settings = MockSettings(args.latency, args.tokens_per_second, args.completion_tokens, args.rate_limit_fraction)
+    server = start_server(settings)
+    workdir = tempfile.mkdtemp(prefix="genai_bench_")
+
+    # Configure the app modules before importing them
+    os.environ.update({
+        "OPENAI_API_ENDPOINT": f"http://127.0.0.1:{server.server_address[1]}",
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_MAX_CONCURRENCY": str(args.concurrency),
+        "OPENAI_REQUESTS_PER_MINUTE": "0",
+        "OPENAI_TOKENS_PER_MINUTE": "0",
+        "QUESTION_CACHE_PERSIST": "false",
+    })
+    sys.path.insert(0, os.path.abspath(SRC_FOLDER))
+    os.chdir(workdir)
+
+    import extraction
+    import openai_connection
+    import rendering
+    import utils
+
+    # Streamlit warns about running outside "streamlit run" on every UI call; the benchmarks don't need a UI
+    logging.disable(logging.WARNING)
+
+    benchmark = Benchmark(settings)
+    for pages in args.pages:
+        pdf_path = os.path.join(workdir, f"fixture_{pages}.pdf")
+        make_fixture_pdf(pdf_path, pages)
+
+        benchmark.run(f"render_{pages}p", lambda: sum(len(url) for url in utils.pdf_to_data_urls(pdf_path)), pages)
+
+        openai_connection.markdown_cache.clear()
+        results = benchmark.run(f"extract_{pages}p", lambda: extraction.extract_markdown(utils.pdf_to_data_urls(pdf_path)), pages)
+        markdown = extraction.combine_pages(results)
+
+        # The same pages rendered with the default adaptive settings, to compare bytes sent against the fixed 72 DPI path
+        benchmark.run(f"render_adaptive_{pages}p", lambda: sum(page["bytes"] for page in rendering.render_pdf(pdf_path)), pages)
+        openai_connection.markdown_cache.clear()
+        benchmark.run(f"extract_adaptive_{pages}p", lambda: extraction.extract_markdown(rendering.render_pdf(pdf_path)), pages)
+        openai_connection.markdown_cache.clear()
+        benchmark.run(f"extract_text_layer_{pages}p", lambda: extraction.extract_markdown(extraction.pdf_pages(pdf_path, text_layer=True)), pages)
+
+        benchmark.run(f"summarize_{pages}p", lambda: openai_connection.summarize(markdown, use_cache=False), 1)
+
+        revised = markdown.replace("Item 1 |", "Item 1 (revised) |", 1)
+        benchmark.run(f"compare_full_{pages}p", lambda: openai_connection.compare(markdown, revised, use_cache=False), 1)
+        benchmark.run(f"compare_changes_{pages}p", lambda: openai_connection.compare(markdown, revised, mode="changes", use_cache=False), 1)
+
+    def infogather_turns(compact=False):
+        history = [{"role": "system", "content": "You are an assistant designed to gather information from users."}]
+        for turn in range(args.chat_turns):
+            prompt = f"My answer number {turn} is here."
+            sent = utils.compact_json_history(history) if compact else history
+            response = openai_connection.chat(prompt, sent, response_format="json")
+            history += [{"role": "user", "content": prompt}, {"role": "assistant", "content": response}]
+
+    benchmark.run(f"infogather_{args.chat_turns}_turns", infogather_turns, args.chat_turns)
+    benchmark.run(f"infogather_compact_{args.chat_turns}_turns", lambda: infogather_turns(compact=True), args.chat_turns)
+
+    server.shutdown()
+    print_table(benchmark.results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "results": benchmark.results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
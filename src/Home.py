@@ -1,15 +1,8 @@
 # code from https://docs.streamlit.io/library/get-started/create-an-app
 import os
-import altair as alt
-import numpy as np
-import pandas as pd
 import streamlit as st
-import base64
 from dotenv import load_dotenv
 
-import openai_connection
-import utils
-
 
 load_dotenv()
 
@@ -30,6 +23,17 @@ if st.button("Delete All Uploaded Files"):
                 file_path = os.path.join(folder_path, file_name)
                 if os.path.isfile(file_path):
                     os.remove(file_path)
+    # Page checkpoints and finished jobs hold the extracted content of the uploads, and the catalog and search index list
+    # the deleted documents
+    import catalog
+    import checkpoints
+    import jobs
+    import search_index
+    
+    checkpoints.clear()
+    jobs.clear()
+    catalog.clear()
+    search_index.clear()
     st.success("All files in the specified folders have been deleted.")
 
 
@@ -46,6 +50,16 @@ if st.button("Delete All Saved Prompts"):
     st.success("All saved prompts have been deleted from the specified folders.")
 
 
+# Add a button to clear the cached model responses
+if st.button("Clear Response Cache"):
+    import openai_connection  # Imported here so the home page loads without the model SDKs
+    
+    openai_connection.markdown_cache.clear()
+    openai_connection.question_cache.clear()
+    openai_connection.comparison_cache.clear()
+    st.success("All cached model responses have been deleted.")
+
+
 
 
 
@@ -0,0 +1,181 @@
+"""
+Two-tier cache for model responses.
+Recently used entries are kept in an in-process LRU (the hot tier) and, unless the cache is memory-only, every entry is
+persisted to a SQLite file in the 'cache' directory, so results survive Streamlit reruns and app restarts. When the file
+grows past its size budget the least recently used rows are evicted. Entries can optionally expire after a time to live.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_FOLDER = "cache"
+
+
+def make_key(*parts):
+    """
+    Builds a cache key from the values that determine a model response.
+    Args:
+        *parts: JSON-serialisable values, e.g. the model name, prompts and request parameters.
+    Returns:
+        str: A SHA-256 hex digest of the parts.
+    """
+
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    A thread-safe cache of string responses with an in-memory LRU in front of a size-bounded SQLite store.
+    Args:
+        name (str): The name of the cache, used for the SQLite file name ('cache/<name>.sqlite').
+        max_memory_items (int, optional): The number of entries kept in the in-process hot tier. Defaults to 256.
+        max_disk_bytes (int, optional): The total size of cached values kept on disk before the least recently used
+                                        entries are evicted. Defaults to 200 MB.
+        ttl (float, optional): Seconds after which an entry expires. Defaults to None (entries never expire).
+        persist (bool, optional): If False, only the in-memory tier is used. Defaults to True.
+    """
+
+    def __init__(self, name, max_memory_items=256, max_disk_bytes=200 * 1024 * 1024, ttl=None, persist=True):
+        self.name = name
+        self.path = os.path.join(CACHE_FOLDER, f"{name}.sqlite")
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self.persist = persist
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if not os.path.exists(CACHE_FOLDER):
+            os.makedirs(CACHE_FOLDER)
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL, "
+            "created REAL NOT NULL DEFAULT 0)"
+        )
+        # Cache files written before entries could expire have no created column
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(entries)")]
+        if "created" not in columns:
+            connection.execute("ALTER TABLE entries ADD COLUMN created REAL NOT NULL DEFAULT 0")
+        connection.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        return connection
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def _remember(self, key, value, created):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """
+        Looks up a cached value, checking the in-memory tier before the disk tier.
+        Args:
+            key (str): The cache key, usually built with `make_key`.
+        Returns:
+            str or None: The cached value, or None if the key is not cached.
+        """
+
+        now = time.time()
+        with self._lock:
+            if key in self._memory:
+                value, created = self._memory[key]
+                if not self._expired(created, now):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    return value
+                del self._memory[key]
+
+            row = None
+            if self.persist:
+                with self._connect() as connection:
+                    row = connection.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+                    if row is not None and self._expired(row[1], now):
+                        connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                        row = None
+                    elif row is not None:
+                        connection.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+                connection.close()
+
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, row[0], row[1])
+            return row[0]
+
+    def set(self, key, value):
+        """
+        Stores a value in both tiers and evicts the least recently used disk entries if the size budget is exceeded.
+        Args:
+            key (str): The cache key, usually built with `make_key`.
+            value (str): The response to cache.
+        """
+
+        size = len(value.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            if not self.persist:
+                return
+            with self._connect() as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, size, last_access, created) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, size, now, now),
+                )
+                connection.execute(
+                    "DELETE FROM entries WHERE key IN ("
+                    "SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY last_access DESC, key) AS running FROM entries) "
+                    "WHERE running > ?)",
+                    (self.max_disk_bytes,),
+                )
+            connection.close()
+
+    def clear(self):
+        """
+        Removes every entry from both tiers and resets the hit and miss counters.
+        """
+
+        with self._lock:
+            self._memory.clear()
+            self.hits = self.memory_hits = self.misses = 0
+            if os.path.exists(self.path):
+                with self._connect() as connection:
+                    connection.execute("DELETE FROM entries")
+                connection.close()
+
+    def stats(self):
+        """
+        Reports how effective the cache has been since the process started.
+        Returns:
+            dict: 'hits', 'memory_hits', 'misses', 'hit_rate', 'memory_entries', 'disk_entries' and 'disk_bytes'.
+        """
+
+        with self._lock:
+            disk_entries, disk_bytes = 0, 0
+            if self.persist and os.path.exists(self.path):
+                with self._connect() as connection:
+                    disk_entries, disk_bytes = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+                connection.close()
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+                "disk_bytes": disk_bytes,
+            }
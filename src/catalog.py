@@ -0,0 +1,186 @@
+"""
+Catalog of the documents in 'markdown_output'.
+Stores each document's name, content hash, size, page count, token estimate, source file and creation time in a SQLite
+file in the 'cache' directory, so document selectors can search and page through thousands of documents without
+listing the folder or reading files on every rerun. Documents are recorded when `utils.save_markdown_output` writes
+them; `sync` picks up files added or removed outside the app.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import cache
+
+CATALOG_PATH = os.path.join(cache.CACHE_FOLDER, "catalog.sqlite")
+DOCUMENT_FOLDER = "markdown_output"
+
+_synced = False
+_sync_lock = threading.Lock()
+
+
+def _connect():
+    if not os.path.exists(cache.CACHE_FOLDER):
+        os.makedirs(cache.CACHE_FOLDER)
+    connection = sqlite3.connect(CATALOG_PATH, timeout=30)
+    connection.row_factory = sqlite3.Row
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS documents ("
+        "filename TEXT PRIMARY KEY, content_hash TEXT NOT NULL, size INTEGER NOT NULL, page_count INTEGER, "
+        "tokens INTEGER NOT NULL, source TEXT, created REAL NOT NULL, modified REAL NOT NULL)"
+    )
+    connection.execute("CREATE INDEX IF NOT EXISTS documents_created ON documents (created)")
+    return connection
+
+
+def _execute(sql, parameters=()):
+    with _connect() as connection:
+        rows = connection.execute(sql, parameters).fetchall()
+    connection.close()
+    return rows
+
+
+def _estimate_tokens(text):
+    # Same estimate as utils.estimate_tokens; utils imports this module so it can't be imported here
+    return (len(text) + 3) // 4
+
+
+def record(filename, markdown, source=None, page_count=None):
+    """
+    Adds or updates a document in the catalog. Called whenever a document is written to DOCUMENT_FOLDER.
+    Args:
+        filename (str): The file name within DOCUMENT_FOLDER, e.g. 'report_output.md'.
+        markdown (str): The document's content.
+        source (str, optional): Where the document came from, e.g. the uploaded file name.
+        page_count (int, optional): The number of pages in the source document, if known.
+    """
+
+    with _connect() as connection:
+        _record(connection, filename, markdown, source, page_count)
+    connection.close()
+
+
+def _record(connection, filename, markdown, source=None, page_count=None):
+    content = markdown.encode("utf-8")
+    path = os.path.join(DOCUMENT_FOLDER, filename)
+    # The file's own size and modification time let `sync` tell whether it has changed since; a new entry's creation
+    # time is when the file was written
+    if os.path.exists(path):
+        stat = os.stat(path)
+        size, modified = stat.st_size, stat.st_mtime
+    else:
+        size, modified = len(content), time.time()
+    connection.execute(
+        "INSERT INTO documents (filename, content_hash, size, page_count, tokens, source, created, modified) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (filename) DO UPDATE SET content_hash = excluded.content_hash, size = excluded.size, "
+        "page_count = COALESCE(excluded.page_count, page_count), tokens = excluded.tokens, source = COALESCE(excluded.source, source), "
+        "modified = excluded.modified",
+        (filename, hashlib.sha256(content).hexdigest(), size, page_count, _estimate_tokens(markdown), source, modified, modified),
+    )
+
+
+def sync(force=False):
+    """
+    Brings the catalog in line with the files in DOCUMENT_FOLDER: records new or changed files and forgets deleted
+    ones. Files are only read if their size or modification time differs from the catalog.
+    Args:
+        force (bool, optional): Sync even if this process has already synced once. Defaults to False, so pages can
+                                call this on every rerun cheaply.
+    """
+
+    global _synced
+    with _sync_lock:
+        if _synced and not force:
+            return
+        # One transaction for the whole folder; committing per file is slow with thousands of documents
+        with _connect() as connection:
+            known = {row["filename"]: (row["size"], row["modified"]) for row in connection.execute("SELECT filename, size, modified FROM documents")}
+            present = set()
+            if os.path.exists(DOCUMENT_FOLDER):
+                with os.scandir(DOCUMENT_FOLDER) as entries:
+                    for entry in entries:
+                        if not entry.is_file() or not entry.name.endswith(".md"):
+                            continue
+                        present.add(entry.name)
+                        stat = entry.stat()
+                        if known.get(entry.name) != (stat.st_size, stat.st_mtime):
+                            with open(entry.path, "r", encoding="utf-8") as f:
+                                _record(connection, entry.name, f.read())
+            connection.executemany("DELETE FROM documents WHERE filename = ?", [(filename,) for filename in set(known) - present])
+        connection.close()
+        _synced = True
+
+
+def count(query=""):
+    """
+    Returns the number of documents whose file name contains the query (case-insensitive).
+    """
+
+    return _execute("SELECT COUNT(*) FROM documents WHERE filename LIKE ? ESCAPE '\\'", (_like(query),))[0][0]
+
+
+def search(query="", limit=50, offset=0):
+    """
+    Returns one page of the documents whose file name contains the query (case-insensitive), newest first.
+    Args:
+        query (str, optional): Text to look for in the file names. Defaults to '' (all documents).
+        limit (int, optional): The page size. Defaults to 50.
+        offset (int, optional): The number of matching documents to skip. Defaults to 0.
+    Returns:
+        list of dict: The documents' 'filename', 'content_hash', 'size', 'page_count', 'tokens', 'source', 'created'
+                      and 'modified'. Content is not loaded; use `read` or `read_preview`.
+    """
+
+    rows = _execute(
+        "SELECT * FROM documents WHERE filename LIKE ? ESCAPE '\\' ORDER BY created DESC, filename LIMIT ? OFFSET ?",
+        (_like(query), limit, offset),
+    )
+    return [dict(row) for row in rows]
+
+
+def get(filename):
+    """
+    Returns a document's catalog entry, as returned by `search`, or None if it is not in the catalog.
+    """
+
+    rows = _execute("SELECT * FROM documents WHERE filename = ?", (filename,))
+    return dict(rows[0]) if rows else None
+
+
+def _like(query):
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def read(filename):
+    """
+    Returns the full content of a document.
+    """
+
+    with open(os.path.join(DOCUMENT_FOLDER, filename), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def read_preview(filename, max_chars=5000):
+    """
+    Returns the start of a document without reading the rest of the file.
+    Args:
+        filename (str): The file name within DOCUMENT_FOLDER.
+        max_chars (int, optional): The number of characters to read. Defaults to 5000.
+    Returns:
+        str: Up to max_chars characters from the start of the document.
+    """
+
+    with open(os.path.join(DOCUMENT_FOLDER, filename), "r", encoding="utf-8") as f:
+        return f.read(max_chars)
+
+
+def clear():
+    """
+    Forgets all documents, e.g. after the files in DOCUMENT_FOLDER have been deleted.
+    """
+
+    if os.path.exists(CATALOG_PATH):
+        _execute("DELETE FROM documents")
@@ -0,0 +1,98 @@
+"""
+Per-page checkpoints for PDF extraction.
+Every page that is extracted successfully is saved under a key made from the document's content and the extraction
+options, in a SQLite file in the 'cache' directory. Extracting the same document with the same options again, e.g.
+retrying a job after a timeout on one page, reuses the saved pages and only processes the pages that are missing.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+
+import cache
+
+CHECKPOINTS_PATH = os.path.join(cache.CACHE_FOLDER, "checkpoints.sqlite")
+
+# Options that change the markdown a page produces; others (such as reporting) don't invalidate checkpoints
+KEY_OPTIONS = ("settings", "text_layer", "local_tables")
+
+
+def _connect():
+    if not os.path.exists(cache.CACHE_FOLDER):
+        os.makedirs(cache.CACHE_FOLDER)
+    connection = sqlite3.connect(CHECKPOINTS_PATH, timeout=30)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS pages ("
+        "document_key TEXT NOT NULL, page_number INTEGER NOT NULL, markdown TEXT NOT NULL, render TEXT, "
+        "PRIMARY KEY (document_key, page_number))"
+    )
+    return connection
+
+
+def file_hash(path):
+    """
+    Returns the SHA-256 hex digest of a file's content, read in 1 MB blocks.
+    """
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def document_key(pdf_path, options):
+    """
+    Builds the checkpoint key of a document extracted with the given options.
+    Args:
+        pdf_path (str): The PDF file.
+        options (dict): The extraction options, as passed to `jobs.submit_job`.
+    Returns:
+        str: The key.
+    """
+
+    return cache.make_key("checkpoint", file_hash(pdf_path), {name: options.get(name) for name in KEY_OPTIONS})
+
+
+def load(key):
+    """
+    Returns the saved pages of a document.
+    Args:
+        key (str): The key from `document_key`.
+    Returns:
+        dict: Page number to a dict with 'markdown' and 'render' (the page's render details, or {}).
+    """
+
+    with _connect() as connection:
+        rows = connection.execute("SELECT page_number, markdown, render FROM pages WHERE document_key = ?", (key,)).fetchall()
+    connection.close()
+    return {page_number: {"markdown": markdown, "render": json.loads(render) if render else {}} for page_number, markdown, render in rows}
+
+
+def save(key, page_number, markdown, render=None):
+    """
+    Saves one successfully extracted page.
+    Args:
+        key (str): The key from `document_key`.
+        page_number (int): The 1-based page number.
+        markdown (str): The page's markdown.
+        render (dict, optional): The page's render details, kept for the rendering report.
+    """
+
+    with _connect() as connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO pages (document_key, page_number, markdown, render) VALUES (?, ?, ?, ?)",
+            (key, page_number, markdown, json.dumps(render or {})),
+        )
+    connection.close()
+
+
+def clear():
+    """
+    Deletes all saved pages.
+    """
+
+    if os.path.exists(CHECKPOINTS_PATH):
+        with _connect() as connection:
+            connection.execute("DELETE FROM pages")
+        connection.close()
@@ -0,0 +1,300 @@
+"""
+Page extraction engine used by the Upload Files page.
+Sends page images to the vision model concurrently with a bounded number of requests in flight,
+reassembles the results in page order and reports pages that failed without discarding the rest.
+Born-digital pages can instead be converted from their text layer locally, including the tables PyMuPDF detects on
+them, so only scanned or image-heavy pages and tables that could not be read reliably are sent to the model.
+"""
+import os
+import re
+import statistics
+
+import metrics
+import openai_connection
+import rendering
+import utils
+
+# Routing thresholds for the text-layer fast path
+MAX_IMAGE_COVERAGE = 0.15  # Pages with more of their area covered by images (scans, figures) go to the model
+MAX_LOCAL_IMAGE_COVERAGE = 0.01  # Smaller images (logos, rules) are dropped locally; larger ones need the model to describe them
+MIN_TEXT_CHARS = 50  # Pages with less text than this have little or no text layer
+MAX_LOOSE_DRAWING_ITEMS = 4  # Lines and shapes outside tables beyond this are likely a chart or diagram
+MAX_GARBLED_FRACTION = 0.02  # Text layers with more unmappable characters than this are unreliable
+LOCAL_TABLE_MIN_CONFIDENCE = float(os.getenv("LOCAL_TABLE_MIN_CONFIDENCE", "0.9"))  # See table_confidence
+
+
+def extract_markdown(image_urls, max_workers=openai_connection.MAX_CONCURRENT_REQUESTS, on_page=None):
+    """
+    Extracts markdown from a sequence of page images, running several vision calls at once.
+    Args:
+        image_urls (iterable of str or dict): The page images in page order, as data URLs, as rendered pages from
+                                              `rendering.render_pdf` (whose vision detail level is then used), or as
+                                              pages from `pdf_pages`. Consumed lazily.
+        max_workers (int, optional): The maximum number of vision calls in flight. Defaults to the
+                                     OPENAI_MAX_CONCURRENCY environment variable, or 4.
+        on_page (callable, optional): Called with each page result as it is collected, in page order.
+                                      Runs in the calling thread so it may update the Streamlit UI.
+    Returns:
+        list of dict: One entry per page with keys 'page_number' (1-based), 'markdown' (str, or None on failure)
+                      and 'error' (str, or None on success). For rendered pages, 'render' holds the page's render
+                      details without the image.
+    """
+
+    results = []
+    for result in iter_extract_markdown(image_urls, max_workers):
+        results.append(result)
+        if on_page:
+            on_page(result)
+
+    return results
+
+
+def iter_extract_markdown(image_urls, max_workers=openai_connection.MAX_CONCURRENT_REQUESTS):
+    """
+    Like `extract_markdown`, but yields each page result in page order as it is collected instead of returning a list,
+    so a long document can be written out page by page without keeping every page's markdown in memory.
+    """
+
+    rendered_pages = {}
+
+    def remember_render(pages):
+        for index, page in enumerate(pages):
+            if isinstance(page, dict):
+                rendered_pages[index] = {key: value for key, value in page.items() if key not in ("data_url", "markdown")}
+            yield page
+
+    # Pages are extracted as workers free up and handed back in page order
+    for index, markdown, error in utils.in_input_order(utils.run_in_parallel(extract_page, remember_render(image_urls), max_workers)):
+        result = {
+            "page_number": index + 1,
+            "markdown": markdown,
+            "error": None if error is None else f"{type(error).__name__}: {error}",
+        }
+        if index in rendered_pages:
+            result["render"] = rendered_pages.pop(index)
+        yield result
+
+
+def extract_page(page):
+    """
+    Extracts the markdown of one page.
+    Args:
+        page (str or dict): A data URL, or a page as yielded by `rendering.render_pdf` or `pdf_pages`.
+    Returns:
+        str: The page's markdown. Pages already converted from the text layer or restored from a checkpoint are
+             returned without calling the model.
+    """
+
+    if isinstance(page, str):
+        return openai_connection.generate_markdown(page)
+    if page.get("markdown") is not None:
+        return page["markdown"]
+    return openai_connection.generate_markdown(page["data_url"], detail=page["detail"])
+
+
+def pdf_pages(pdf_path, settings=None, text_layer=False, local_tables=True, compare_baseline=False, checkpointed=None):
+    """
+    Prepares each page of a PDF for `extract_markdown`, one page at a time.
+    Args:
+        pdf_path (str): The file path to the PDF document.
+        settings (dict, optional): Render settings from `rendering.render_settings`, used for pages sent to the model.
+        text_layer (bool, optional): Convert pages that don't need vision from their text layer locally instead of
+                                     rendering them. Defaults to False, which sends every page to the model.
+        local_tables (bool, optional): With text_layer, also convert pages with tables locally when every table on
+                                       the page is read with at least LOCAL_TABLE_MIN_CONFIDENCE. Defaults to True.
+        compare_baseline (bool, optional): Also measure each page with the previous fixed rendering, for the report.
+        checkpointed (dict, optional): Pages already extracted, from `checkpoints.load`. These are yielded from the
+                                       checkpoint without being analysed or rendered again.
+    Yields:
+        dict: For pages sent to the model, a rendered page as returned by `rendering.render_for_vision`. For pages
+              converted locally, 'page_number', 'markdown', 'bytes' and 'image_tokens' (both 0). Both carry 'method'
+              ('vision' or 'text') and 'reason' (why the page was routed that way). Checkpointed pages are yielded
+              with their saved markdown and render details, and 'checkpointed' set to True.
+    """
+
+    import fitz
+
+    settings = settings or rendering.DEFAULT_SETTINGS
+    checkpointed = checkpointed or {}
+    with fitz.open(pdf_path) as pdf_document:
+        for page in pdf_document:
+            saved = checkpointed.get(page.number + 1)
+            if saved is not None:
+                yield {**saved["render"], "page_number": page.number + 1, "markdown": saved["markdown"], "checkpointed": True}
+                continue
+            yield prepare_page(page, settings, text_layer, local_tables, compare_baseline)
+
+
+def prepare_page(page, settings=None, text_layer=False, local_tables=True, compare_baseline=False):
+    """
+    Prepares one PDF page for `extract_markdown`: routes it and either converts it locally or renders it.
+    Args:
+        page (fitz.Page): The page.
+        settings, text_layer, local_tables, compare_baseline: As for `pdf_pages`.
+    Returns:
+        dict: The prepared page, as yielded by `pdf_pages`.
+    """
+
+    settings = settings or rendering.DEFAULT_SETTINGS
+    route = route_page(page, local_tables) if text_layer else {"method": "vision", "reason": "all pages"}
+    tables = route.pop("tables", [])
+    if route["method"] == "text":
+        with metrics.track("text_layer_page"):
+            prepared = {
+                "page_number": page.number + 1,
+                "markdown": text_layer_markdown(page, tables),
+                "bytes": 0,
+                "image_tokens": 0,
+            }
+        if compare_baseline:
+            prepared["baseline_bytes"], prepared["baseline_tokens"] = rendering.baseline_cost(page)
+    else:
+        prepared = rendering.render_for_vision(page, settings, compare_baseline)
+    prepared.update(route)
+    return prepared
+
+
+def route_page(page, local_tables=False):
+    """
+    Decides whether a page can be converted from its text layer or needs the vision model.
+    Args:
+        page (fitz.Page): The page.
+        local_tables (bool, optional): Keep pages with tables local when every table passes `table_confidence`.
+                                       Defaults to False, which sends all pages with tables to the model.
+    Returns:
+        dict: 'method' ('text' or 'vision') and 'reason', a short explanation for the report. Pages with tables
+              converted locally also have 'tables', the detected `fitz.table.Table` objects.
+    """
+
+    import fitz
+
+    profile = rendering.profile_page(page)
+    if profile["image_coverage"] > MAX_IMAGE_COVERAGE:
+        return {"method": "vision", "reason": "scanned or image-heavy"}
+    if profile["text_chars"] < MIN_TEXT_CHARS:
+        return {"method": "vision", "reason": "little or no text layer"}
+    if profile["image_coverage"] > MAX_LOCAL_IMAGE_COVERAGE:
+        return {"method": "vision", "reason": "embedded image"}
+
+    text = page.get_text("text")
+    if text.strip() and text.count("\ufffd") / len(text) > MAX_GARBLED_FRACTION:
+        return {"method": "vision", "reason": "unreadable text layer"}
+
+    # Table detection only looks at ruling lines, so pages without drawings can skip it
+    tables = page.find_tables().tables if profile["ruled_lines"] else []
+
+    # Drawings that aren't table rulings (charts, diagrams) have no text equivalent
+    if profile["ruled_lines"] > MAX_LOOSE_DRAWING_ITEMS:
+        table_areas = [fitz.Rect(table.bbox) + (-2, -2, 2, 2) for table in tables]
+        loose_items = sum(
+            len(drawing["items"]) for drawing in page.get_drawings()
+            if not any(area.contains(drawing["rect"]) for area in table_areas)
+        )
+        if loose_items > MAX_LOOSE_DRAWING_ITEMS:
+            return {"method": "vision", "reason": "chart or drawing"}
+
+    if tables:
+        if not local_tables:
+            return {"method": "vision", "reason": "table"}
+        confidence = min(table_confidence(page, table) for table in tables)
+        if confidence < LOCAL_TABLE_MIN_CONFIDENCE:
+            return {"method": "vision", "reason": f"table confidence {confidence:.2f}"}
+        return {"method": "text", "reason": f"{len(tables)} table(s) read locally", "tables": tables}
+
+    return {"method": "text", "reason": "text layer"}
+
+
+def table_confidence(page, table):
+    """
+    Scores how reliably a detected table was read, from 0 to 1.
+    Args:
+        page (fitz.Page): The page the table is on.
+        table (fitz.table.Table): A table from `page.find_tables()`.
+    Returns:
+        float: 0 for tables with fewer than two rows or columns. Otherwise the fraction of the text inside the table's
+               area that ended up in its cells (merged or misaligned cells lose text), reduced when fewer than half of
+               the cells have content (a grid detected around something that is not a table).
+    """
+
+    if table.row_count < 2 or table.col_count < 2:
+        return 0.0
+    cells = [cell for row in table.extract() for cell in row]
+    filled = sum(1 for cell in cells if cell and cell.strip()) / len(cells)
+    captured = sum(len(re.sub(r"\s", "", cell or "")) for cell in cells)
+    expected = len(re.sub(r"\s", "", page.get_text("text", clip=table.bbox)))
+    if not expected:
+        return 0.0
+    coverage = min(1.0, captured / expected)
+    return round(coverage * min(1.0, filled * 2), 3)
+
+
+def text_layer_markdown(page, tables=()):
+    """
+    Converts a page's text layer to markdown in the same shape as the vision model's output.
+    Args:
+        page (fitz.Page): The page.
+        tables (list of fitz.table.Table, optional): Tables detected on the page, written as markdown tables in
+                                                     place of the text blocks inside them. Defaults to none.
+    Returns:
+        str: 'Page <n>' followed by one paragraph per text block, with the tables placed by their position on the
+             page. Blocks set in a noticeably larger font than the body text become headings.
+    """
+
+    import fitz
+
+    table_rects = [fitz.Rect(table.bbox) for table in tables]
+    blocks = [
+        block for block in page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]
+        if block["type"] == 0 and not any(rect.contains(_center(block["bbox"])) for rect in table_rects)
+    ]
+    sizes = [span["size"] for block in blocks for line in block["lines"] for span in line["spans"] if span["text"].strip()]
+    body_size = statistics.median(sizes) if sizes else 0
+
+    # Blocks keep the page's reading order; each table goes before the first block that starts below its top edge
+    pending_tables = sorted(tables, key=lambda table: table.bbox[1])
+    parts = [f"Page {page.number + 1}"]
+    for block in blocks:
+        while pending_tables and pending_tables[0].bbox[1] <= block["bbox"][1]:
+            parts.append(pending_tables.pop(0).to_markdown().strip())
+        lines = ["".join(span["text"] for span in line["spans"]).strip() for line in block["lines"]]
+        text = " ".join(line for line in lines if line)
+        if not text:
+            continue
+        size = max(span["size"] for line in block["lines"] for span in line["spans"])
+        if size >= body_size * 1.5 and len(text) < 120:
+            text = f"# {text}"
+        elif size >= body_size * 1.2 and len(text) < 120:
+            text = f"## {text}"
+        parts.append(text)
+    parts += [table.to_markdown().strip() for table in pending_tables]
+    return "\n\n".join(parts) + "\n\n"
+
+
+def _center(bbox):
+    import fitz
+
+    return fitz.Point((bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2)
+
+
+def combine_pages(results):
+    """
+    Joins the markdown of the successfully extracted pages in page order.
+    Args:
+        results (list of dict): Page results as returned by `extract_markdown`.
+    Returns:
+        str: The concatenated markdown of all pages that did not fail.
+    """
+
+    return "".join(result["markdown"] for result in results if result["markdown"])
+
+
+def failed_pages(results):
+    """
+    Returns the page results that failed during extraction.
+    Args:
+        results (list of dict): Page results as returned by `extract_markdown`.
+    Returns:
+        list of dict: The results whose 'error' is set.
+    """
+
+    return [result for result in results if result["error"]]
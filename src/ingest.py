@@ -0,0 +1,282 @@
+"""
+Headless bulk ingestion of a folder of PDFs and images into 'markdown_output'.
+Pages are prepared (routed, rendered or converted from the text layer) a few at a time in a pool of worker processes,
+because PyMuPDF rendering is CPU-bound and holds the GIL, and are fed into a bounded pool of concurrent vision calls as
+they become ready. Only a bounded number of prepared pages are held at once, however large the documents are. Each
+document is saved with `utils.save_markdown_output`, so it appears in the app's catalog and search index exactly as if
+it had been uploaded. Extracted pages are checkpointed, so an interrupted run can simply be started again:
+documents already in 'markdown_output' are skipped and partly extracted documents resume where they stopped.
+Run it from the folder the app is started from, so documents land in the 'markdown_output' folder the app reads.
+Usage:
+    python src/ingest.py /archive/policies
+    python src/ingest.py /archive/policies --recursive --text-layer --render-workers 8 --concurrency 8
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import catalog
+import checkpoints
+import extraction
+import metrics
+import openai_connection
+import rendering
+import utils
+
+PDF_EXTENSIONS = (".pdf",)
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp")
+PAGES_PER_TASK = 4  # Pages a worker prepares per task; large documents are spread over all the workers
+
+
+def find_documents(folder, recursive=False):
+    """
+    Lists the PDFs and images in a folder, sorted by path.
+    Args:
+        folder (str): The folder to ingest.
+        recursive (bool, optional): Also look in subfolders. Defaults to False.
+    Returns:
+        list of str: The file paths.
+    """
+
+    paths = []
+    for root, folders, files in os.walk(folder):
+        paths += [os.path.join(root, name) for name in files if name.lower().endswith(PDF_EXTENSIONS + IMAGE_EXTENSIONS)]
+        if not recursive:
+            break
+    return sorted(paths)
+
+
+def document_name(path):
+    """
+    Returns the name a file is saved under, the same as for an upload: the file name without its extension.
+    """
+
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def prepare_pages(task):
+    """
+    Prepares some pages of a PDF for extraction. Runs in a worker process.
+    Args:
+        task (tuple): (path, page_numbers, options), where page_numbers are 1-based and options are the
+                      `extraction.pdf_pages` keyword arguments 'settings', 'text_layer' and 'local_tables'.
+    Returns:
+        list of dict: The pages in order, as accepted by `extraction.extract_page`.
+    """
+
+    path, page_numbers, options = task
+    with fitz.open(path) as pdf_document:
+        return [extraction.prepare_page(pdf_document[page_number - 1], **options) for page_number in page_numbers]
+
+
+def ingest(paths, options, render_workers, concurrency):
+    """
+    Extracts and saves a list of documents, printing a line as each one finishes.
+    Args:
+        paths (list of str): The documents to ingest.
+        options (dict): The `extraction.pdf_pages` options, as for `prepare_pages`.
+        render_workers (int): The number of worker processes preparing pages. At most render_workers * 2 *
+                              PAGES_PER_TASK prepared pages wait for the extraction stage.
+        concurrency (int): The maximum number of vision calls in flight. Pages are extracted at most concurrency * 2
+                           positions ahead of the oldest unfinished page, so a slow page holds back a bounded number
+                           of results.
+    Returns:
+        dict: 'documents', 'failed', 'pages', 'vision_pages' and 'seconds'.
+    """
+
+    summary = {"documents": 0, "failed": 0, "pages": 0, "vision_pages": 0, "seconds": 0.0}
+    started = time.perf_counter()
+    documents = {}  # Index in paths to the document's prepared pages and the results collected so far
+
+    def page_tasks():
+        # Splits each document into runs of pages: (index, page_numbers, pages) where pages are already prepared
+        # (checkpointed pages and images) or None if the pages still have to be prepared by a worker
+        for index, path in enumerate(paths):
+            if path.lower().endswith(IMAGE_EXTENSIONS):
+                documents[index] = {"checkpoint_key": None, "page_count": 1, "results": []}
+                yield index, [1], [utils.create_data_url(path)]
+                continue
+            try:
+                with fitz.open(path) as pdf_document:
+                    page_count = pdf_document.page_count
+                checkpoint_key = checkpoints.document_key(path, options)
+                checkpointed = checkpoints.load(checkpoint_key)
+            except Exception as error:
+                report(index, path, error=f"{type(error).__name__}: {error}")
+                continue
+            if not page_count:
+                report(index, path, error="No pages")
+                continue
+            documents[index] = {"checkpoint_key": checkpoint_key, "page_count": page_count, "results": []}
+            run = []
+            for page_number in range(1, page_count + 1):
+                saved = checkpointed.get(page_number)
+                if saved is None:
+                    run.append(page_number)
+                    if len(run) < PAGES_PER_TASK and page_number < page_count:
+                        continue
+                if run:
+                    yield index, run, None
+                    run = []
+                if saved is not None:
+                    yield index, [page_number], [{**saved["render"], "page_number": page_number, "markdown": saved["markdown"], "checkpointed": True}]
+
+    def prepared_pages(executor):
+        # Keeps a bounded number of pages prepared ahead of the extraction stage, so rendering never runs far ahead
+        # of the model and a large document is prepared by all the workers at once
+        window = deque()
+        window_pages = 0
+        tasks = page_tasks()
+
+        def fill():
+            nonlocal window_pages
+            while window_pages < render_workers * 2 * PAGES_PER_TASK:
+                task = next(tasks, None)
+                if task is None:
+                    return
+                index, page_numbers, pages = task
+                if pages is None:
+                    pages = executor.submit(prepare_pages, (paths[index], page_numbers, options))
+                window.append((index, page_numbers, pages))
+                window_pages += len(page_numbers)
+
+        fill()
+        while window:
+            index, page_numbers, pages = window.popleft()
+            window_pages -= len(page_numbers)
+            fill()
+            if not isinstance(pages, list):
+                try:
+                    pages = pages.result()
+                except Exception as error:
+                    # The pages are recorded as failed, so the document is not saved and the next run retries them
+                    pages = [{"page_number": page_number, "error": f"{type(error).__name__}: {error}"} for page_number in page_numbers]
+            for page in pages:
+                yield index, page
+
+    def extract(item):
+        page = item[1]
+        if isinstance(page, dict) and page.get("error"):
+            raise RuntimeError(page["error"])
+        return extraction.extract_page(page)
+
+    def report(index, path, error=None, page_count=0):
+        summary["documents"] += 1
+        summary["failed"] += error is not None
+        elapsed = time.perf_counter() - started
+        status = f"failed ({error})" if error else f"{page_count} pages"
+        print(f"[{summary['documents']}/{len(paths)}] {path}: {status} - {summary['pages'] / elapsed:.2f} pages/s overall", flush=True)
+
+    def finish(index, path):
+        document = documents.pop(index)
+        results = document["results"]
+        failed = extraction.failed_pages(results)
+        if failed:
+            # Nothing is saved, so the next run picks the document up again and only extracts the failed pages
+            report(index, path, error=f"{len(failed)} of {len(results)} pages failed: {failed[0]['error']}")
+            return
+        utils.save_markdown_output(document_name(path), extraction.combine_pages(results), source=os.path.basename(path), page_count=len(results))
+        report(index, path, page_count=len(results))
+
+    # Worker processes are spawned rather than forked, as the extraction stage runs threads in this process
+    with ProcessPoolExecutor(max_workers=render_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        items = prepared_pages(executor)
+        for (index, page), markdown, error in _with_items(items, extract, concurrency, concurrency * 2):
+            document = documents[index]
+            page_number = len(document["results"]) + 1
+            document["results"].append({
+                "page_number": page_number,
+                "markdown": markdown,
+                "error": None if error is None else f"{type(error).__name__}: {error}",
+            })
+            if document["checkpoint_key"] and markdown is not None and not page["checkpointed"]:
+                checkpoints.save(document["checkpoint_key"], page_number, markdown, page["render"])
+            summary["pages"] += 1
+            summary["vision_pages"] += page["vision"]
+            if len(document["results"]) == document["page_count"]:
+                finish(index, paths[index])
+
+    summary["seconds"] = time.perf_counter() - started
+    return summary
+
+
+def _with_items(items, func, max_workers, max_ahead):
+    # Results are put back in input order, so each result belongs to the oldest item not yet returned. Only the
+    # document index and the page's render details are kept for it, not its image
+    pending = deque()
+
+    def remember(items):
+        for index, page in items:
+            pending.append((index, _page_details(page)))
+            yield index, page
+
+    for _, result, error in utils.in_input_order(utils.run_in_parallel(func, remember(items), max_workers, max_ahead)):
+        yield pending.popleft(), result, error
+
+
+def _page_details(page):
+    if not isinstance(page, dict):
+        # An image file's data URL
+        return {"render": {}, "checkpointed": False, "vision": True}
+    return {
+        "render": {key: value for key, value in page.items() if key not in ("data_url", "markdown")},
+        "checkpointed": bool(page.get("checkpointed")),
+        "vision": page.get("markdown") is None and not page.get("error"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract a folder of PDFs and images into markdown_output.")
+    parser.add_argument("folder", help="The folder of documents to ingest.")
+    parser.add_argument("--recursive", action="store_true", help="Also ingest documents in subfolders.")
+    parser.add_argument("--force", action="store_true", help="Extract documents that are already in markdown_output again.")
+    parser.add_argument("--text-layer", action="store_true", help="Convert pages with a usable text layer locally instead of with the vision model.")
+    parser.add_argument("--no-local-tables", action="store_true", help="With --text-layer, send pages with tables to the vision model.")
+    parser.add_argument("--render-mode", choices=("adaptive", "fixed"), default=rendering.DEFAULT_SETTINGS["mode"])
+    parser.add_argument("--render-workers", type=int, default=os.cpu_count() or 1, help="Worker processes preparing pages (default: CPU count).")
+    parser.add_argument("--concurrency", type=int, default=openai_connection.MAX_CONCURRENT_REQUESTS, help="Vision calls in flight (default: OPENAI_MAX_CONCURRENCY).")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.folder):
+        parser.error(f"{args.folder} is not a folder")
+
+    paths = find_documents(args.folder, args.recursive)
+    if not args.force:
+        catalog.sync()
+        paths = [path for path in paths if catalog.get(document_name(path) + "_output.md") is None]
+    print(f"{len(paths)} documents to ingest", flush=True)
+    if not paths:
+        return
+
+    options = {
+        "settings": rendering.render_settings(mode=args.render_mode),
+        "text_layer": args.text_layer,
+        "local_tables": not args.no_local_tables,
+    }
+    summary = ingest(paths, options, max(1, args.render_workers), max(1, args.concurrency))
+
+    usage = metrics.totals().get("generate_markdown", {})
+    print(
+        f"\n{summary['documents'] - summary['failed']} documents ingested, {summary['failed']} failed; "
+        f"{summary['pages']} pages ({summary['vision_pages']} sent to the model) in {summary['seconds']:.1f}s, "
+        f"{summary['pages'] / max(summary['seconds'], 1e-9):.2f} pages/s"
+    )
+    print(
+        f"Model calls: {usage.get('calls', 0)} ({usage.get('cache_hits', 0)} cached, {usage.get('errors', 0)} failed), "
+        f"{usage.get('prompt_tokens', 0)} prompt tokens, {usage.get('completion_tokens', 0)} completion tokens"
+    )
+    if summary["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
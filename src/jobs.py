@@ -0,0 +1,238 @@
+"""
+Background PDF extraction jobs.
+Submitted jobs run on a process-wide worker pool, independently of the Streamlit session that submitted them, so
+widget interactions and browser refreshes neither interrupt nor duplicate the work. Jobs and their per-page results
+are persisted to a SQLite file in the 'cache' directory; pages poll `get_job` and `job_pages` to show progress and
+can attach to any job, including one submitted before a refresh. Each extracted page is also checkpointed, so a retried
+or restarted job only processes the pages it is missing.
+Job code runs outside the Streamlit script thread and must not call Streamlit APIs.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import cache
+import checkpoints
+import extraction
+import utils
+
+JOBS_PATH = os.path.join(cache.CACHE_FOLDER, "jobs.sqlite")
+MAX_JOB_WORKERS = int(os.getenv("EXTRACTION_JOB_WORKERS", "2"))
+
+FINISHED_STATUSES = ("done", "failed")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _connect():
+    if not os.path.exists(cache.CACHE_FOLDER):
+        os.makedirs(cache.CACHE_FOLDER)
+    connection = sqlite3.connect(JOBS_PATH, timeout=30)
+    connection.row_factory = sqlite3.Row
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, pdf_path TEXT NOT NULL, options TEXT NOT NULL, "
+        "status TEXT NOT NULL, pages_total INTEGER, pages_done INTEGER NOT NULL DEFAULT 0, "
+        "pages_failed INTEGER NOT NULL DEFAULT 0, output_path TEXT, error TEXT, "
+        "created REAL NOT NULL, started REAL, finished REAL)"
+    )
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS job_pages ("
+        "job_id INTEGER NOT NULL, page_number INTEGER NOT NULL, markdown TEXT, error TEXT, render TEXT, "
+        "PRIMARY KEY (job_id, page_number))"
+    )
+    return connection
+
+
+def _execute(sql, parameters=()):
+    with _connect() as connection:
+        cursor = connection.execute(sql, parameters)
+        rows = cursor.fetchall()
+        lastrowid = cursor.lastrowid
+    connection.close()
+    return rows, lastrowid
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_JOB_WORKERS, thread_name_prefix="extraction-job")
+            # Jobs left unfinished by a previous app process are started again
+            rows, _ = _execute("SELECT id FROM jobs WHERE status IN ('queued', 'running') ORDER BY id")
+            for row in rows:
+                _executor.submit(_run_job, row["id"])
+        return _executor
+
+
+def submit_job(pdf_path, name, options):
+    """
+    Queues a PDF for extraction on the background worker pool.
+    Args:
+        pdf_path (str): The uploaded PDF. It must stay in place until the job has finished.
+        name (str): The document name the markdown is saved under (see `utils.save_markdown_output`).
+        options (dict): Keyword arguments for `extraction.pdf_pages`: 'settings' (render settings), 'text_layer',
+                        'local_tables' and 'compare_baseline'. Must be JSON-serialisable.
+    Returns:
+        int: The job id.
+    """
+
+    # Start the pool first, so restarting unfinished jobs doesn't also pick up this one
+    executor = _get_executor()
+    _, job_id = _execute(
+        "INSERT INTO jobs (name, pdf_path, options, status, created) VALUES (?, ?, ?, 'queued', ?)",
+        (name, pdf_path, json.dumps(options), time.time()),
+    )
+    executor.submit(_run_job, job_id)
+    return job_id
+
+
+def get_job(job_id):
+    """
+    Returns the state of a job.
+    Args:
+        job_id (int): The job id.
+    Returns:
+        dict or None: The job's 'id', 'name', 'status' ('queued', 'running', 'done' or 'failed'), 'pages_total'
+                      (None until the job starts), 'pages_done', 'pages_failed', 'output_path', 'error', 'created',
+                      'started' and 'finished', or None if there is no such job.
+    """
+
+    rows, _ = _execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+    if not rows:
+        return None
+    job = dict(rows[0])
+    job["options"] = json.loads(job["options"])
+    return job
+
+
+def list_jobs(limit=20):
+    """
+    Returns the most recent jobs, newest first, as returned by `get_job`.
+    Also restarts jobs left unfinished by a previous app process, if that has not happened yet.
+    """
+
+    _get_executor()
+    rows, _ = _execute("SELECT id FROM jobs ORDER BY id DESC LIMIT ?", (limit,))
+    return [get_job(row["id"]) for row in rows]
+
+
+def retry_job(job_id):
+    """
+    Runs a finished job again, e.g. after some of its pages failed. Pages that were extracted successfully are reused
+    from their checkpoints, so only the missing pages are sent to the model.
+    Args:
+        job_id (int): The job id.
+    Returns:
+        bool: True if the job was queued, False if it does not exist or has not finished.
+    """
+
+    executor = _get_executor()
+    job = get_job(job_id)
+    if job is None or job["status"] not in FINISHED_STATUSES:
+        return False
+    _execute("UPDATE jobs SET status = 'queued', error = NULL, finished = NULL WHERE id = ?", (job_id,))
+    executor.submit(_run_job, job_id)
+    return True
+
+
+def clear():
+    """
+    Deletes all finished jobs and their pages, e.g. after the uploads and their output files have been deleted.
+    Queued and running jobs are kept.
+    """
+
+    if os.path.exists(JOBS_PATH):
+        with _connect() as connection:
+            connection.execute(
+                f"DELETE FROM job_pages WHERE job_id IN (SELECT id FROM jobs WHERE status IN ({','.join('?' * len(FINISHED_STATUSES))}))",
+                FINISHED_STATUSES,
+            )
+            connection.execute(f"DELETE FROM jobs WHERE status IN ({','.join('?' * len(FINISHED_STATUSES))})", FINISHED_STATUSES)
+        connection.close()
+
+
+def job_pages(job_id, with_markdown=True):
+    """
+    Returns the pages a job has finished so far, in page order.
+    Args:
+        job_id (int): The job id.
+        with_markdown (bool, optional): Load each page's markdown. Defaults to True; pass False when only the page
+                                        errors and render details are needed, e.g. for a long document.
+    Returns:
+        list of dict: Page results in the shape returned by `extraction.extract_markdown`. Without markdown,
+                      'markdown' is None for every page.
+    """
+
+    columns = "page_number, error, render" + (", markdown" if with_markdown else "")
+    rows, _ = _execute(f"SELECT {columns} FROM job_pages WHERE job_id = ? ORDER BY page_number", (job_id,))
+    return [
+        {
+            "page_number": row["page_number"],
+            "markdown": row["markdown"] if with_markdown else None,
+            "error": row["error"],
+            "render": json.loads(row["render"]) if row["render"] else {},
+        }
+        for row in rows
+    ]
+
+
+def _run_job(job_id):
+    job = get_job(job_id)
+    if job is None or job["status"] in FINISHED_STATUSES:
+        return
+
+    options = job["options"]
+    try:
+        checkpoint_key = checkpoints.document_key(job["pdf_path"], options)
+        page_count = utils.pdf_page_count(job["pdf_path"])
+        _execute(
+            "UPDATE jobs SET status = 'running', pages_total = ?, pages_done = 0, pages_failed = 0, started = ? WHERE id = ?",
+            (page_count, time.time(), job_id),
+        )
+        _execute("DELETE FROM job_pages WHERE job_id = ?", (job_id,))
+
+        def record_page(result):
+            render = result.get("render", {})
+            if result["markdown"] is not None and not render.get("checkpointed"):
+                checkpoints.save(checkpoint_key, result["page_number"], result["markdown"], render)
+            _execute(
+                "INSERT OR REPLACE INTO job_pages (job_id, page_number, markdown, error, render) VALUES (?, ?, ?, ?, ?)",
+                (job_id, result["page_number"], result["markdown"], result["error"], json.dumps(render)),
+            )
+            _execute(
+                "UPDATE jobs SET pages_done = pages_done + 1, pages_failed = pages_failed + ? WHERE id = ?",
+                (1 if result["error"] else 0, job_id),
+            )
+
+        pages = extraction.pdf_pages(
+            job["pdf_path"],
+            options.get("settings"),
+            text_layer=options.get("text_layer", False),
+            local_tables=options.get("local_tables", True),
+            compare_baseline=options.get("compare_baseline", False),
+            checkpointed=checkpoints.load(checkpoint_key),
+        )
+
+        def extracted_markdown():
+            # Pages are rendered, extracted and appended to the output one at a time, so memory use doesn't grow with
+            # the length of the document
+            for result in extraction.iter_extract_markdown(pages):
+                record_page(result)
+                if result["markdown"]:
+                    yield result["markdown"]
+
+        output_path = utils.write_markdown_output(
+            job["name"], extracted_markdown(), source=os.path.basename(job["pdf_path"]), page_count=page_count)
+        _execute("UPDATE jobs SET status = 'done', output_path = ?, finished = ? WHERE id = ?", (output_path, time.time(), job_id))
+    except Exception as error:
+        traceback.print_exc()
+        _execute(
+            "UPDATE jobs SET status = 'failed', error = ?, finished = ? WHERE id = ?",
+            (f"{type(error).__name__}: {error}", time.time(), job_id),
+        )
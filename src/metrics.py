@@ -0,0 +1,313 @@
+"""
+In-process instrumentation for model calls and document rendering.
+Instrumented functions record their latency, token usage, cache hits and error class into a fixed-size ring buffer
+shared by all sessions in the process. The Metrics page summarises the buffer, and `prometheus_text` exports it in the
+Prometheus text format.
+"""
+import contextlib
+import functools
+import math
+import os
+import threading
+import time
+import types
+from collections import deque
+
+_records = deque(maxlen=int(os.getenv("METRICS_BUFFER_SIZE", "5000")))
+_totals = {}  # Running totals per name, which unlike the ring buffer cover every call since the process started
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def _current():
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def _start(name):
+    record = {
+        "name": name,
+        "timestamp": time.time(),
+        "duration": None,
+        "first_token": None,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "retries": 0,
+        "queued_seconds": 0.0,
+        "cache_hit": False,
+        "error": None,
+        "_started": time.perf_counter(),
+    }
+    _stack().append(record)
+    return record
+
+
+def _finish(record, error=None):
+    record["duration"] = time.perf_counter() - record.pop("_started")
+    if error is not None and record["error"] is None:
+        record["error"] = type(error).__name__
+    with _lock:
+        _records.append(record)
+        totals = _totals.setdefault(record["name"], {"calls": 0, "cache_hits": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0})
+        totals["calls"] += 1
+        totals["cache_hits"] += record["cache_hit"]
+        totals["errors"] += record["error"] is not None
+        totals["prompt_tokens"] += record["prompt_tokens"]
+        totals["completion_tokens"] += record["completion_tokens"]
+
+
+def _pop(record):
+    stack = _stack()
+    if record in stack:
+        stack.remove(record)
+
+
+def instrumented(name):
+    """
+    Decorator that records each call of the function under the given name.
+    Args:
+        name (str): The name the calls are reported under.
+    Returns:
+        callable: The decorator.
+    Notes:
+        - If the function returns a generator (e.g. a streamed response), the call is recorded when the generator is
+          exhausted or closed, and the time to the first item is recorded as 'first_token'.
+        - Exceptions are recorded by class name and re-raised.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            record = _start(name)
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as error:
+                _pop(record)
+                _finish(record, error)
+                raise
+            _pop(record)
+            if isinstance(result, types.GeneratorType):
+                return _finish_when_consumed(result, record)
+            _finish(record)
+            return result
+        return wrapper
+    return decorator
+
+
+def _finish_when_consumed(generator, record):
+    error = None
+    try:
+        while True:
+            # Make the record current while the generator runs so nested calls can add usage to it
+            _stack().append(record)
+            try:
+                item = next(generator)
+            except StopIteration:
+                break
+            finally:
+                _pop(record)
+            if record["first_token"] is None:
+                record["first_token"] = time.perf_counter() - record["_started"]
+            yield item
+    except BaseException as exception:
+        error = exception
+        raise
+    finally:
+        _finish(record, error)
+
+
+@contextlib.contextmanager
+def track(name):
+    """
+    Records the enclosed block as one call, for code that is not a single function.
+    Args:
+        name (str): The name the call is reported under.
+    Yields:
+        dict: The record being collected.
+    Example:
+        with metrics.track("render_page"):
+            pix = page.get_pixmap()
+    """
+
+    record = _start(name)
+    error = None
+    try:
+        yield record
+    except BaseException as exception:
+        error = exception
+        raise
+    finally:
+        _pop(record)
+        _finish(record, error)
+
+
+def add_usage(usage):
+    """
+    Adds the token usage of a model response to the call currently being recorded on this thread.
+    Args:
+        usage: The `usage` attribute of an OpenAI response, or None.
+    """
+
+    record = _current()
+    if record is not None and usage is not None:
+        record["prompt_tokens"] += usage.prompt_tokens or 0
+        record["completion_tokens"] += usage.completion_tokens or 0
+
+
+def add(field, amount):
+    """
+    Adds to a numeric field ('retries', 'queued_seconds', ...) of the call currently being recorded on this thread.
+    """
+
+    record = _current()
+    if record is not None:
+        record[field] += amount
+
+
+def mark_cache_hit():
+    """
+    Marks the call currently being recorded on this thread as served from a cache.
+    """
+
+    record = _current()
+    if record is not None:
+        record["cache_hit"] = True
+
+
+def mark_error(error):
+    """
+    Records an error that the current call handled itself (e.g. by returning an error message) instead of raising.
+    """
+
+    record = _current()
+    if record is not None:
+        record["error"] = type(error).__name__
+
+
+def records():
+    """
+    Returns a snapshot of the recorded calls, oldest first.
+    Returns:
+        list of dict: The records in the ring buffer.
+    """
+
+    with _lock:
+        return list(_records)
+
+
+def totals():
+    """
+    Returns the call counts and token usage of each instrumented name since the process started (or `reset`).
+    Returns:
+        dict: Name to a dict with 'calls', 'cache_hits', 'errors', 'prompt_tokens' and 'completion_tokens'.
+    """
+
+    with _lock:
+        return {name: dict(values) for name, values in _totals.items()}
+
+
+def reset():
+    """
+    Discards all recorded calls.
+    """
+
+    with _lock:
+        _records.clear()
+        _totals.clear()
+
+
+def percentile(values, fraction):
+    """
+    Returns the nearest-rank percentile of a list of numbers.
+    Args:
+        values (list of float): The values.
+        fraction (float): The percentile as a fraction, e.g. 0.95.
+    Returns:
+        float or None: The percentile, or None if there are no values.
+    """
+
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summary():
+    """
+    Aggregates the recorded calls per function name.
+    Returns:
+        list of dict: One row per name with call, error and cache hit counts, p50/p95 latency in seconds,
+                      p50 time to first token for streamed calls, and total prompt and completion tokens.
+    """
+
+    grouped = {}
+    for record in records():
+        grouped.setdefault(record["name"], []).append(record)
+
+    rows = []
+    for name, calls in sorted(grouped.items()):
+        durations = [call["duration"] for call in calls]
+        first_tokens = [call["first_token"] for call in calls if call["first_token"] is not None]
+        rows.append({
+            "function": name,
+            "calls": len(calls),
+            "errors": sum(1 for call in calls if call["error"]),
+            "cache_hits": sum(1 for call in calls if call["cache_hit"]),
+            "p50_seconds": percentile(durations, 0.5),
+            "p95_seconds": percentile(durations, 0.95),
+            "p50_first_token_seconds": percentile(first_tokens, 0.5),
+            "prompt_tokens": sum(call["prompt_tokens"] for call in calls),
+            "completion_tokens": sum(call["completion_tokens"] for call in calls),
+            "retries": sum(call["retries"] for call in calls),
+        })
+    return rows
+
+
+def prometheus_text():
+    """
+    Exports the recorded calls in the Prometheus text exposition format.
+    Returns:
+        str: The metrics. Counts cover only the calls still in the ring buffer.
+    """
+
+    grouped = {}
+    for record in records():
+        grouped.setdefault(record["name"], []).append(record)
+
+    lines = [
+        "# HELP genai_call_duration_seconds Latency of instrumented calls in the metrics ring buffer.",
+        "# TYPE genai_call_duration_seconds summary",
+    ]
+    for name, calls in sorted(grouped.items()):
+        durations = [call["duration"] for call in calls]
+        for quantile in (0.5, 0.95):
+            lines.append(f'genai_call_duration_seconds{{function="{name}",quantile="{quantile}"}} {percentile(durations, quantile):.6f}')
+        lines.append(f'genai_call_duration_seconds_sum{{function="{name}"}} {sum(durations):.6f}')
+        lines.append(f'genai_call_duration_seconds_count{{function="{name}"}} {len(durations)}')
+
+    lines += ["# HELP genai_tokens_total Model tokens used by instrumented calls.", "# TYPE genai_tokens_total counter"]
+    for name, calls in sorted(grouped.items()):
+        lines.append(f'genai_tokens_total{{function="{name}",type="prompt"}} {sum(call["prompt_tokens"] for call in calls)}')
+        lines.append(f'genai_tokens_total{{function="{name}",type="completion"}} {sum(call["completion_tokens"] for call in calls)}')
+
+    lines += ["# HELP genai_cache_hits_total Calls served from a cache.", "# TYPE genai_cache_hits_total counter"]
+    for name, calls in sorted(grouped.items()):
+        lines.append(f'genai_cache_hits_total{{function="{name}"}} {sum(1 for call in calls if call["cache_hit"])}')
+
+    lines += ["# HELP genai_errors_total Failed calls by error class.", "# TYPE genai_errors_total counter"]
+    for name, calls in sorted(grouped.items()):
+        errors = {}
+        for call in calls:
+            if call["error"]:
+                errors[call["error"]] = errors.get(call["error"], 0) + 1
+        for error, count in sorted(errors.items()):
+            lines.append(f'genai_errors_total{{function="{name}",error="{error}"}} {count}')
+
+    return "\n".join(lines) + "\n"
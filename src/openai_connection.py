@@ -1,43 +1,281 @@
-import openai
+import base64
+import email.utils
+import hashlib
+import io
 import os
+import random
 import streamlit as st
-import urllib.request
-from azure.ai.projects import AIProjectClient
-from azure.ai.agents.models import ListSortOrder
-from azure.identity import DefaultAzureCredential
+import threading
+import time
 
 from dotenv import load_dotenv
 
+import cache
+import metrics
+import rate_limiter
+import rendering
+import utils
+
 load_dotenv()
 
-client = openai.AzureOpenAI(
-  azure_endpoint = os.getenv("OPENAI_API_ENDPOINT"), 
-  api_key=os.getenv("OPENAI_API_KEY"),  
-  api_version="2024-02-01"
+# The OpenAI and Azure SDKs are imported inside the functions that use them, so pages that never call a model
+# (or never use AI Foundry) don't pay their import cost on a cold start.
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Returns the process-wide Azure OpenAI client, creating it on first use.
+    Returns:
+        openai.AzureOpenAI: The shared client.
+    """
+    
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import openai
+                
+                _client = openai.AzureOpenAI(
+                  azure_endpoint = os.getenv("OPENAI_API_ENDPOINT"), 
+                  api_key=os.getenv("OPENAI_API_KEY"),  
+                  api_version="2024-02-01",
+                  # Retries are handled by _create_completion so they can respect the shared rate limiter
+                  max_retries=0
+                )
+    return _client
+
+
+# Shared by every session in the process so the combined load stays within the deployment's quotas
+request_limiter = rate_limiter.RateLimiter(
+    requests_per_minute=int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "900")),
+    tokens_per_minute=int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "150000"))
 )
 
-def question(prompt, system_prompt="You are a helpful assistant."):
+MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+
+# Cache of question() responses, so repeated summaries and comparisons of the same input return instantly
+question_cache = cache.ResponseCache(
+    "question",
+    ttl=float(os.getenv("QUESTION_CACHE_TTL_SECONDS", "86400")),
+    persist=os.getenv("QUESTION_CACHE_PERSIST", "true").lower() == "true"
+)
+
+# Cache of pairwise comparisons keyed on the two documents' content hashes, so batch comparisons skip unchanged pairs
+# without reading the documents
+comparison_cache = cache.ResponseCache(
+    "comparison",
+    ttl=float(os.getenv("QUESTION_CACHE_TTL_SECONDS", "86400")),
+    persist=os.getenv("QUESTION_CACHE_PERSIST", "true").lower() == "true"
+)
+
+# Maximum number of model calls a single operation (page extraction, chunked summaries) runs at once
+MAX_CONCURRENT_REQUESTS = int(os.getenv("OPENAI_MAX_CONCURRENCY", "4"))
+
+# Documents estimated above this many tokens are summarized in chunks and then combined
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "12000"))
+
+# Rounds of summarizing the chunk summaries again before the combined summaries are used as they are
+MAX_SUMMARY_ROUNDS = 3
+
+# Token budget for the conversation sent by chat(); older turns beyond it are dropped or summarized
+CHAT_HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", "32000"))
+
+HISTORY_SUMMARY_PROMPT = """You are an AI assistant that keeps a running summary of a conversation between a user and an assistant.
+Update the existing summary (if any) with the new turns you are given. Keep facts, decisions, names, numbers and open questions.
+Reply with the updated summary only, in no more than 300 words."""
+
+CHUNK_SUMMARY_PROMPT = """You are an AI assistant that summarizes one part of a longer markdown document.
+Summarize the part you are given so that it can be combined with summaries of the other parts.
+Keep the key facts, figures, names, dates, obligations and the contents of any tables. Do not add an introduction or conclusion."""
+
+# Cache of page extraction results, keyed on the image and everything else that determines the response.
+markdown_cache = cache.ResponseCache(
+    "generate_markdown",
+    max_disk_bytes=int(os.getenv("MARKDOWN_CACHE_MAX_MB", "200")) * 1024 * 1024
+)
+
+@metrics.instrumented("question")
+def question(prompt, system_prompt="You are a helpful assistant.", stream=False, use_cache=True):
     """
     Generates a response from the OpenAI GPT-4o model based on a user prompt and an optional system prompt.
     Args:
         prompt (str): The user's input or question to be sent to the language model.
         system_prompt (str, optional): The system-level instruction or context for the assistant. Defaults to "You are a helpful assistant.".
+        stream (bool, optional): If True, return a generator of response text deltas instead of waiting for the
+                                 complete response. Defaults to False.
+        use_cache (bool, optional): If False, always call the model and refresh the cached response. Defaults to True.
     Returns:
-        str: The content of the model's response to the user's prompt.
+        str or generator: The content of the model's response to the user's prompt, or a generator of text deltas if stream is True.
+    Notes:
+        - Responses are cached in `question_cache`, keyed on the model, system prompt and prompt. A cached response is
+          returned as a single delta when streaming.
     """
 
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
+    params = {
+        "model": "gpt-4o",
+        "messages": [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": prompt}
         ]
-    )
+    }
+    
+    cache_key = cache.make_key("question", params["model"], system_prompt, prompt)
+    cached = question_cache.get(cache_key) if use_cache else None
+    if cached is not None:
+        metrics.mark_cache_hit()
+        return iter([cached]) if stream else cached
+
+    if stream:
+        return _cache_stream(_stream_completion(params), cache_key)
+
+    response = _create_completion(**params)
+    content = response.choices[0].message.content
+    if content:
+        question_cache.set(cache_key, content)
+
+    return content
+
+
+def _cache_stream(deltas, cache_key):
+    """
+    Passes streamed deltas through and caches the assembled response once the stream completes.
+    """
+    
+    parts = []
+    for delta in deltas:
+        parts.append(delta)
+        yield delta
+    if parts:
+        question_cache.set(cache_key, "".join(parts))
 
-    return response.choices[0].message.content
+
+def _create_completion(**params):
+    """
+    Sends a chat completion request through the shared rate limiter, retrying transient failures.
+    Args:
+        **params: The arguments for `get_client().chat.completions.create`.
+    Returns:
+        The completion response (or stream, if stream=True is passed).
+    Raises:
+        openai.APIError: If the request fails with a non-transient error or still fails after MAX_RETRIES retries.
+    Notes:
+        - Rate limit (429), timeout, connection and server (5xx) errors are retried with jittered exponential backoff.
+        - A Retry-After header on the error is honoured, and on 429 the whole limiter is paused so other sessions back off too.
+    """
     
+    import openai
     
-def chat(prompt, history, response_format=None):
+    tokens = _estimate_request_tokens(params)
+    for attempt in range(MAX_RETRIES + 1):
+        metrics.add("queued_seconds", request_limiter.acquire(tokens))
+        try:
+            response = get_client().chat.completions.create(**params)
+            if not params.get("stream"):
+                metrics.add_usage(getattr(response, "usage", None))
+            return response
+        except openai.APIError as error:
+            if attempt == MAX_RETRIES or not _is_transient(error):
+                raise
+            metrics.add("retries", 1)
+            delay = _retry_delay(error, attempt)
+            if isinstance(error, openai.RateLimitError):
+                request_limiter.pause(delay)
+            print(f"Model request failed with {type(error).__name__}, retrying in {delay:.1f}s (attempt {attempt + 1} of {MAX_RETRIES})")
+            time.sleep(delay)
+
+
+def _estimate_request_tokens(params):
+    """
+    Estimates the tokens a request counts against the quota: the prompt plus the maximum completion length.
+    Images are counted at 85 tokens at low detail, otherwise at their tile cost (see `_image_tokens`).
+    """
+    
+    tokens = params.get("max_tokens") or 1000
+    for message in params["messages"]:
+        content = message["content"]
+        if isinstance(content, str):
+            tokens += utils.message_tokens(message)
+        else:
+            for part in content:
+                if part["type"] == "text":
+                    tokens += utils.estimate_tokens(part["text"])
+                else:
+                    tokens += _image_tokens(part["image_url"])
+    return tokens
+
+
+def _image_tokens(image_url):
+    # Data URLs are measured, so larger renders are charged for their extra tiles; other images are counted at the
+    # cost of a high detail 1024px image
+    if image_url.get("detail") == "low":
+        return 85
+    url = image_url["url"]
+    if url.startswith("data:"):
+        try:
+            from PIL import Image  # Installed with Streamlit
+
+            # Only the image header is decoded
+            with Image.open(io.BytesIO(base64.b64decode(url.split(",", 1)[1]))) as image:
+                return rendering.image_tokens(*image.size)
+        except Exception:
+            pass
+    return 765
+
+
+def _is_transient(error):
+    import openai
+    
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    return getattr(error, "status_code", None) in (408, 409)
+
+
+def _retry_delay(error, attempt):
+    """
+    Returns the Retry-After delay from the error response if there is one, otherwise exponential backoff with full jitter.
+    """
+    
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after_ms = response.headers.get("retry-after-ms")
+        retry_after = response.headers.get("retry-after")
+        if retry_after_ms and retry_after_ms.replace(".", "", 1).isdigit():
+            return float(retry_after_ms) / 1000
+        if retry_after and retry_after.replace(".", "", 1).isdigit():
+            return float(retry_after)
+        if retry_after:
+            # Retry-After may also be an HTTP date
+            try:
+                return max(0.0, email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    
+    return random.uniform(0, min(60, 2 ** attempt))
+
+
+def _stream_completion(params):
+    """
+    Requests a streamed completion and yields the text deltas as they arrive.
+    The request is only sent when the generator is first iterated, so timing the iteration includes the time to first token.
+    """
+
+    response = _create_completion(stream=True, **params)
+    completion_tokens = 0
+    for chunk in response:
+        # Azure sends chunks without choices (e.g. content filter results) which carry no text
+        if chunk.choices and chunk.choices[0].delta.content:
+            completion_tokens += utils.estimate_tokens(chunk.choices[0].delta.content)
+            yield chunk.choices[0].delta.content
+    
+    # Streamed responses don't report usage, so record estimates instead
+    metrics.add("prompt_tokens", sum(utils.message_tokens(message) for message in params["messages"]))
+    metrics.add("completion_tokens", completion_tokens)
+    
+    
+@metrics.instrumented("chat")
+def chat(prompt, history, response_format=None, stream=False, max_history_tokens=None, summarize_history=False):
     """
     Sends a chat prompt along with conversation history to the OpenAI GPT-4o model and returns the assistant's response.
     Args:
@@ -46,14 +284,26 @@ def chat(prompt, history, response_format=None):
         response_format (str, optional): The format for the response. If set to 'json', the API will be instructed
                                          to return a JSON object but the function will still return a string. 
                                          Defaults to None (plain text).
+        stream (bool, optional): If True, return a generator of response text deltas, suitable for `st.write_stream`.
+                                 Defaults to False.
+        max_history_tokens (int, optional): The token budget for the messages sent. System messages and the newest
+                                            turns are kept; older turns are left out. Defaults to CHAT_HISTORY_TOKENS.
+        summarize_history (bool, optional): If True, turns left out of the budget are folded into a rolling summary
+                                            that is sent as a system message. Defaults to False.
     Returns:
-        str: The content of the model's response as a string, or an error message if the request fails.
+        str or generator: The content of the model's response as a string, or an error message if the request fails.
+                          If stream is True, a generator yielding the same text in pieces.
     Raises:
         None: All exceptions are handled within the function.
     """
     
     messages=history + [{"role": "user", "content": prompt}]
     
+    # Keep the request within the history budget and report what was left out
+    messages, trimmed_tokens = _fit_history(messages, max_history_tokens or CHAT_HISTORY_TOKENS, summarize_history)
+    if trimmed_tokens:
+        st.caption(f"{trimmed_tokens} tokens of older conversation were trimmed from this request.")
+    
     # Set up the API parameters
     params = {
         "model": "gpt-4o",
@@ -64,19 +314,93 @@ def chat(prompt, history, response_format=None):
     if response_format == 'json':
         params["response_format"] = {"type": "json_object"}
     
+    if stream:
+        return _stream_chat(params)
+    
+    import openai
+    
     with st.spinner("Waiting for response..."):
         try:
-            response = client.chat.completions.create(**params)
+            response = _create_completion(**params)
             return response.choices[0].message.content
             
-        except urllib.error.HTTPError as error:
-            print("The request failed with status code: " + str(error.code))
-            print(error.info())
-            print(error.read().decode("utf8", 'ignore'))
-            return "Sorry, I am unable to process your request at the moment. The request failed with status code: " + str(error.code)
+        except openai.APIError as error:
+            return _request_failed_message(error)
 
 
-def generate_markdown(image_url):
+def _fit_history(messages, max_tokens, summarize_history):
+    """
+    Applies the history budget to a conversation, optionally replacing the dropped turns with a rolling summary.
+    Returns:
+        tuple: (messages, trimmed_tokens) with the messages to send and the estimated tokens left out.
+    """
+    
+    kept, dropped = utils.fit_history(messages, max_tokens)
+    if dropped and summarize_history:
+        # Leave room for the summary itself
+        kept, dropped = utils.fit_history(messages, max_tokens - max_tokens // 10)
+        summary = _summarize_dropped_turns(dropped)
+        first_turn = next(index for index, message in enumerate(kept) if message["role"] != "system")
+        kept.insert(first_turn, {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+    
+    return kept, sum(utils.message_tokens(message) for message in dropped)
+
+
+def _summarize_dropped_turns(dropped):
+    """
+    Returns a summary of the turns that no longer fit the history budget.
+    The summary is kept in session state and only the turns dropped since the previous call are folded into it,
+    so each turn is summarized once rather than on every request.
+    """
+    
+    summaries = st.session_state.setdefault("chat_history_summaries", {})
+    conversation_key = cache.make_key(dropped[0])
+    previous = summaries.get(conversation_key)
+    
+    if previous and previous["count"] <= len(dropped) and previous["key"] == cache.make_key(dropped[:previous["count"]]):
+        new_turns = dropped[previous["count"]:]
+        summary = previous["summary"]
+    else:
+        new_turns = dropped
+        summary = ""
+    
+    if new_turns:
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in new_turns)
+        summary = question(f"Existing summary:\n{summary or '(none)'}\n\nNew turns:\n{transcript}", HISTORY_SUMMARY_PROMPT)
+        summaries[conversation_key] = {"count": len(dropped), "key": cache.make_key(dropped), "summary": summary}
+    
+    return summary
+
+
+def _stream_chat(params):
+    """
+    Streams a chat completion, yielding an error message instead of raising if the request fails.
+    """
+    import openai
+
+    with st.spinner("Waiting for response..."):
+        try:
+            deltas = _stream_completion(params)
+            first_delta = next(deltas, "")
+        except openai.APIError as error:
+            yield _request_failed_message(error)
+            return
+    
+    yield first_delta
+    yield from deltas
+
+
+def _request_failed_message(error):
+    metrics.mark_error(error)
+    print(f"The request failed: {type(error).__name__}: {error}")
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        return "Sorry, I am unable to process your request at the moment. The model service could not be reached."
+    return "Sorry, I am unable to process your request at the moment. The request failed with status code: " + str(status_code)
+
+
+@metrics.instrumented("generate_markdown")
+def generate_markdown(image_url, detail="auto"):
     """
     Extracts text content, especially tables, from an image using the GPT-4o model via OpenAI's API.
     The function sends a system prompt instructing the model to extract text and tables from the provided image URL.
@@ -84,9 +408,13 @@ def generate_markdown(image_url):
     followed by a summary or analysis of the extracted content.
     Args:
         image_url (str): The URL of the image from which to extract text and tables.
+        detail (str, optional): The vision detail level, 'low', 'high' or 'auto'. 'low' costs a fixed 85 image
+                                tokens and suits pages with little content. Defaults to 'auto'.
     Returns:
         str: The extracted content in markdown format, as generated by the GPT-4o model.
-    
+    Notes:
+        - Results are cached in `markdown_cache`, keyed on a hash of the image together with the detail level, prompt,
+          model and max_tokens, so the same page image is only sent to the model once.
     """
     
     system_prompt = """
@@ -106,9 +434,18 @@ def generate_markdown(image_url):
     
     Savings were significantly lower in February. This is surprising because it is a short month and contributing to pension shuld be a priority.
     """
+    model = "gpt-4o"
+    max_tokens = 2000
+    
+    image_hash = hashlib.sha256(image_url.encode("utf-8")).hexdigest()
+    cache_key = cache.make_key("generate_markdown", model, max_tokens, system_prompt, image_hash, detail)
+    cached = markdown_cache.get(cache_key)
+    if cached is not None:
+        metrics.mark_cache_hit()
+        return cached
     
-    response = client.chat.completions.create(
-        model="gpt-4o",
+    response = _create_completion(
+        model=model,
         messages=[
             {
                 "role": "system",
@@ -120,54 +457,201 @@ def generate_markdown(image_url):
                     {"type": "text", "text": "Extract text from the image"},
                     {
                         "type": "image_url",
-                        "image_url": {"url": image_url},
+                        "image_url": {"url": image_url, "detail": detail},
                     },
                 ],
             },
         ],
-        max_tokens=2000,
+        max_tokens=max_tokens,
         temperature=0.0,
     )
     
-    return response.choices[0].message.content
+    markdown = response.choices[0].message.content
+    if markdown:
+        markdown_cache.set(cache_key, markdown)
+    return markdown
 
 
-def summarize(markdown):
+def summarize(markdown, stream=False, use_cache=True):
     """
     Summarizes the given markdown text using an AI assistant.
     Args:
         markdown (str): The markdown text to be summarized.
+        stream (bool, optional): If True, return a generator of summary text deltas. Defaults to False.
+        use_cache (bool, optional): If False, regenerate the summary instead of reusing a cached one. Defaults to True.
     Returns:
-        str: The summarized version of the input markdown text, generated by the AI assistant.
+        str or generator: The summarized version of the input markdown text, generated by the AI assistant.
     Notes:
         - Uses a system prompt from Streamlit session state with the key "summarize_prompt".
         - Relies on the `question` function to interact with the AI assistant.
+        - Documents estimated at more than SUMMARY_CHUNK_TOKENS tokens are split on page and heading boundaries,
+          the chunks are summarized in parallel and the "summarize_prompt" is applied to the combined chunk summaries.
+          Smaller documents are summarized with a single call.
     """
     
     system_prompt = st.session_state.get("summarize_prompt", "You are an AI assistant that summarizes markdown text")
-    prompt = f"Input:\n{markdown}"
+    
+    if utils.estimate_tokens(markdown) > SUMMARY_CHUNK_TOKENS:
+        with st.spinner("Summarizing document sections..."):
+            markdown = _summarize_chunks(markdown, use_cache)
+        prompt = f"Input (summaries of consecutive sections of one document):\n{markdown}"
+    else:
+        prompt = f"Input:\n{markdown}"
 
-    return question(prompt, system_prompt)
+    return question(prompt, system_prompt, stream=stream, use_cache=use_cache)
 
 
-def compare(markdown1, markdown2):
+@metrics.instrumented("compare_pair")
+def compare_pair(content_hash1, content_hash2, load_documents, system_prompt, mode="full", use_cache=True):
+    """
+    Compares two documents identified by their content hashes, for batch comparisons run on worker threads.
+    Args:
+        content_hash1 (str): The content hash of the first document (see `catalog`).
+        content_hash2 (str): The content hash of the second document.
+        load_documents (callable): Returns the two documents' markdown as (markdown1, markdown2). Only called if the
+                                   pair is not cached.
+        system_prompt (str): The comparison system prompt.
+        mode (str, optional): As for `compare`. Defaults to "full".
+        use_cache (bool, optional): If False, regenerate the comparison instead of reusing a cached one. Defaults to True.
+    Returns:
+        str: The comparison result.
+    Notes:
+        - Results are cached in `comparison_cache`, keyed on the two hashes, the mode and the system prompt, so a
+          cached pair costs neither a model call nor reading the documents.
+        - Does not use Streamlit APIs, so it is safe to call from `utils.run_in_parallel`.
+    """
+
+    cache_key = cache.make_key("compare", "gpt-4o", content_hash1, content_hash2, mode, system_prompt)
+    cached = comparison_cache.get(cache_key) if use_cache else None
+    if cached is not None:
+        metrics.mark_cache_hit()
+        return cached
+
+    markdown1, markdown2 = load_documents()
+    result = compare(markdown1, markdown2, mode=mode, use_cache=use_cache, system_prompt=system_prompt)
+    if result:
+        comparison_cache.set(cache_key, result)
+    return result
+
+
+def _summarize_chunks(markdown, use_cache=True):
+    """
+    Reduces a document to section summaries that fit within SUMMARY_CHUNK_TOKENS, summarizing the summaries again if
+    they are still too long.
+    Args:
+        markdown (str): The markdown document to reduce.
+    Returns:
+        str: The section summaries in document order, separated by blank lines.
+    Raises:
+        Exception: The first error raised while summarizing a chunk, so a summary is never built from missing sections.
+    Notes:
+        - Stops after MAX_SUMMARY_ROUNDS rounds, or as soon as a round doesn't make the text shorter, and returns the
+          shortest text so far even if it is still longer than SUMMARY_CHUNK_TOKENS. Each round is paid for, and a
+          round that doesn't shrink the text would be repeated forever.
+    """
+    
+    for _ in range(MAX_SUMMARY_ROUNDS):
+        tokens = utils.estimate_tokens(markdown)
+        if tokens <= SUMMARY_CHUNK_TOKENS:
+            break
+        chunks = utils.split_markdown(markdown, SUMMARY_CHUNK_TOKENS)
+        prompts = [f"Input (part {number} of {len(chunks)}):\n{chunk}" for number, chunk in enumerate(chunks, start=1)]
+        
+        summaries = [None] * len(prompts)
+        for index, summary, error in utils.run_in_parallel(lambda prompt: question(prompt, CHUNK_SUMMARY_PROMPT, use_cache=use_cache), prompts, MAX_CONCURRENT_REQUESTS):
+            if error is not None:
+                raise error
+            summaries[index] = summary
+        
+        combined = "\n\n".join(summaries)
+        if utils.estimate_tokens(combined) >= tokens:
+            break
+        markdown = combined
+    
+    return markdown
+
+
+def compare(markdown1, markdown2, stream=False, mode="full", use_cache=True, system_prompt=None):
     """
     Compares two markdown documents using an AI assistant.
     Args:
         markdown1 (str): The first markdown document to compare.
         markdown2 (str): The second markdown document to compare.
+        stream (bool, optional): If True, return a generator of comparison text deltas. Defaults to False.
+        mode (str, optional): How much of the documents to send to the model:
+            - "full": send both complete documents (default).
+            - "changes": diff the documents locally and send only the changed regions with a little context.
+              Falls back to "full" when the diff is not smaller than the documents.
+            - "mechanical": return the local diff report without calling the model.
+        use_cache (bool, optional): If False, regenerate the comparison instead of reusing a cached one. Defaults to True.
+        system_prompt (str, optional): The system prompt. Defaults to the one in Streamlit session state with the key
+                                       "comparison_prompt", or a default prompt if not set. Pass it explicitly when
+                                       calling from a worker thread, which has no session state.
     Returns:
-        str: The AI-generated comparison result between the two markdown documents.
+        str or generator: The AI-generated comparison result between the two markdown documents.
     Notes:
-        - Uses a system prompt from Streamlit session state with the key "comparison_prompt", or a default prompt if not set.
         - Relies on the `question` function to interact with the AI assistant.
     """
     
-    system_prompt = st.session_state.get("comparison_prompt", "You are an AI assistant that compares two markdown documents")
+    if system_prompt is None:
+        system_prompt = st.session_state.get("comparison_prompt", "You are an AI assistant that compares two markdown documents")
     prompt = f"Input:\n\n--- Start of Document 1 ---\n{markdown1}\n--- End of Document 1 ---\n\n--- Start of Document 2 ---\n{markdown2}\n--- End of Document 2 ---"
 
-    return question(prompt, system_prompt)
+    if mode in ("changes", "mechanical"):
+        diff = utils.diff_markdown(markdown1, markdown2)
+        report = utils.format_markdown_diff(diff)
+        
+        if mode == "mechanical" or diff["identical"]:
+            return iter([report]) if stream else report
+        
+        changes_prompt = (
+            "Input:\n\nDocument 1 and Document 2 are revisions of the same document. Only the regions that differ are "
+            "shown below as unified diffs: lines starting with '-' are from Document 1, lines starting with '+' are from "
+            "Document 2 and the other lines are unchanged context. Everything not shown is identical in both documents.\n\n"
+            f"{report}"
+        )
+        if len(changes_prompt) < len(prompt):
+            prompt = changes_prompt
+
+    return question(prompt, system_prompt, stream=stream, use_cache=use_cache)
+
+@st.cache_resource(show_spinner=False)
+def _get_ai_project_client(endpoint):
+    """
+    Returns a process-wide AI Project client for the endpoint, shared across all Streamlit sessions.
+    Reusing the client keeps its HTTP connections open, and reusing its DefaultAzureCredential means the credential
+    chain is only probed once and access tokens are cached until they expire.
+    Args:
+        endpoint (str): The AI Foundry project endpoint.
+    Returns:
+        AIProjectClient: The shared client.
+    """
+    
+    from azure.ai.projects import AIProjectClient
+    from azure.identity import DefaultAzureCredential
+    
+    return AIProjectClient(
+        credential=DefaultAzureCredential(),
+        endpoint=endpoint
+    )
+
+
+@st.cache_resource(show_spinner=False, ttl=int(os.getenv("AI_FOUNDRY_AGENT_CACHE_SECONDS", "300")))
+def _get_ai_foundry_agent(endpoint, agent_id):
+    """
+    Fetches the agent definition, caching it for AI_FOUNDRY_AGENT_CACHE_SECONDS (default 300) so it is not
+    re-fetched on every message.
+    Args:
+        endpoint (str): The AI Foundry project endpoint.
+        agent_id (str): The ID of the agent.
+    Returns:
+        Agent: The agent metadata.
+    """
+    
+    return _get_ai_project_client(endpoint).agents.get_agent(agent_id)
 
+
+@metrics.instrumented("ai_foundry_get_messages")
 def ai_foundry_get_messages(thread_id):
     """
     Retrieves and formats messages from an AI Foundry thread.
@@ -193,11 +677,10 @@ def ai_foundry_get_messages(thread_id):
         return [{"role": "assistant", "content": f"Error: AI Foundry configuration is missing. Please check environment variables: {', '.join(missing_vars)}"}]
     
     try:
-        # Initialize the AI Project client
-        project = AIProjectClient(
-            credential=DefaultAzureCredential(),
-            endpoint=ai_foundry_endpoint
-        )
+        # Reuse the shared AI Project client
+        project = _get_ai_project_client(ai_foundry_endpoint)
+        
+        from azure.ai.agents.models import ListSortOrder
         
         # Get messages from the thread
         messages = project.agents.messages.list(
@@ -217,8 +700,10 @@ def ai_foundry_get_messages(thread_id):
         return formatted_messages
         
     except Exception as e:
+        metrics.mark_error(e)
         return [{"role": "assistant", "content": f"Error: {str(e)}"}]
 
+@metrics.instrumented("ai_foundry_process_message")
 def ai_foundry_process_message(prompt):
     """
     Sends a user message to the AI Foundry agent, creates or uses an existing thread,
@@ -245,14 +730,11 @@ def ai_foundry_process_message(prompt):
         return f"Error: AI Foundry configuration is missing. Please check environment variables: {', '.join(missing_vars)}"
     
     try:
-        # Initialize the AI Project client
-        project = AIProjectClient(
-            credential=DefaultAzureCredential(),
-            endpoint=ai_foundry_endpoint
-        )
+        # Reuse the shared AI Project client
+        project = _get_ai_project_client(ai_foundry_endpoint)
         
-        # Get the agent
-        agent = project.agents.get_agent(ai_foundry_agent_id)
+        # Get the agent (cached for AI_FOUNDRY_AGENT_CACHE_SECONDS)
+        agent = _get_ai_foundry_agent(ai_foundry_endpoint, ai_foundry_agent_id)
         
         # Create a new thread if needed or use existing thread
         if "ai_foundry_thread_id" not in st.session_state:
@@ -281,6 +763,7 @@ def ai_foundry_process_message(prompt):
         return "Success"
             
     except Exception as e:
+        metrics.mark_error(e)
         return f"Error: {str(e)}"
 
 # TODO create button to delete all uploaded pdfs and images.
\ No newline at end of file
@@ -6,21 +6,30 @@ Features:
 - Displays all previous chat messages (system, user, assistant) on each rerun.
 - Accepts user input via a chat input box.
 - Sends user input and chat history to the OpenAI API via the `openai_connection.chat` function.
+- Streams the assistant response as it is generated and shows the time to first token.
 - Displays both user and assistant messages in the chat interface.
 - Updates the chat history after each interaction.
+- Keeps long conversations within a token budget, optionally summarizing the older messages.
 Dependencies:
 - streamlit
 - openai_connection (custom module for OpenAI API interaction)
 Session State Keys:
 - "chat_messages": List of message dictionaries with "role" and "content" keys.
+- "chat_summarize_history": Whether trimmed messages are replaced with a running summary.
 Usage:
 - Place this file in the Streamlit app's pages directory.
 - Ensure `openai_connection` is implemented and available in the import path.
 """
 import streamlit as st
 import openai_connection
+import utils
 
 st.subheader("Chat")
+st.sidebar.toggle(
+    "Summarize older messages",
+    key="chat_summarize_history",
+    help="Long conversations are trimmed to the most recent messages. Turn this on to replace the trimmed messages with a running summary instead.")
+
 # Initialize chat history
 if "chat_messages" not in st.session_state:
     st.session_state.chat_messages = []
@@ -38,10 +47,13 @@ if prompt := st.chat_input("What is up?"):
     with st.chat_message("user"):
         st.markdown(prompt)
     
-    response = openai_connection.chat(prompt, st.session_state.chat_messages)
-    # Display assistant response in chat message container
+    # Stream the assistant response into the chat message container as it is generated
     with st.chat_message("assistant"):
-        st.markdown(response)
+        response = utils.write_stream(openai_connection.chat(
+            prompt,
+            st.session_state.chat_messages,
+            stream=True,
+            summarize_history=st.session_state.get("chat_summarize_history", False)))
         
     # Add assistant response to chat history
     st.session_state.chat_messages.append({"role": "user", "content": prompt})
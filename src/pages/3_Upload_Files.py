@@ -1,18 +1,29 @@
 """
 3_Upload_Files.py
 This Streamlit page provides an interface for uploading and processing files in three formats: PDF, Image, and Text.
-- For PDF uploads, users can select the extraction method (GPT 4o or Doc Intelligence), upload a PDF, and extract text from its images using AI models.
+- For PDF uploads, users can select the extraction method (GPT 4o, Text layer + GPT 4o or Doc Intelligence), upload a PDF, and extract text from its images using AI models.
+  Text layer + GPT 4o converts born-digital pages from the PDF's text layer locally, including tables that PyMuPDF can read reliably, and only sends scanned or image-heavy pages and uncertain tables to the model.
+  The rendering options control the resolution, colour and compression of the page images, and can report the bytes and image tokens sent per page.
 - For Image uploads, users can upload an image file and extract text using AI models.
 - For Text uploads, users can input text directly and save it as a markdown file.
-The extracted or input text is saved as a markdown file in the 'markdown_output' directory. Uploaded files are stored in the 'uploads' directory. The page uses utility functions for file handling and AI-based text extraction.
+PDFs are extracted by a background job, so the page can be used, rerun or refreshed while it runs; the page shows the progress of the selected job and its results when it has finished.
+Extracted pages are checkpointed, so pages extracted so far can be viewed and retrying a job only processes the pages that are missing.
+The extracted or input text is saved as a markdown file in the 'markdown_output' directory; PDF pages are appended to it as they are extracted, so memory use doesn't grow with the length of the document. Uploaded files are stored in the 'uploads' directory when they are submitted. The page uses utility functions for file handling and AI-based text extraction.
 """
 
 import streamlit as st
 import os
+import catalog
 import utils
 import openai_connection
+import extraction
+import jobs
+import rendering
 
 
+# Long documents are shown in part; the full markdown is in the output file
+MAX_PREVIEW_CHARS = 100000
+
 st.title("Upload Files")
 st.write("Use this page to upload PDF documents, images, or text content that you want to convert to markdown format and analyze with AI. The files uploaded here can be used in the Comparison and Summarization pages.")
 
@@ -26,42 +37,129 @@ if upload_type == "PDF":
     
     extract_type = st.radio(
     "Select way to extract text from pdf:",
-    ("GPT 4o", "Doc Intelligence"),
+    ("GPT 4o", "Text layer + GPT 4o", "Doc Intelligence"),
     horizontal=True)
     
+    local_tables = True
+    if extract_type == "Text layer + GPT 4o":
+        local_tables = st.checkbox("Convert tables locally when they are detected with high confidence", value=True)
+    
+    with st.expander("Rendering options"):
+        defaults = rendering.DEFAULT_SETTINGS
+        render_mode = st.radio(
+            "Page resolution:",
+            ("adaptive", "fixed"),
+            index=0 if defaults["mode"] == "adaptive" else 1,
+            format_func=lambda mode: "Adaptive (low detail for sparse pages, more pixels for tables)" if mode == "adaptive" else "Fixed",
+            horizontal=True)
+        render_dpi = st.slider("DPI", 50, 300, defaults["dpi"], step=10)
+        render_max_side = st.number_input("Longest side (pixels)", 256, 4096, defaults["max_side"], step=128)
+        render_format = st.radio("Format", ("jpeg", "webp"), index=0 if defaults["format"] == "jpeg" else 1, horizontal=True)
+        render_quality = st.slider("Quality", 10, 100, defaults["quality"])
+        render_grayscale = st.checkbox("Grayscale", value=defaults["grayscale"])
+        render_compare = st.checkbox("Report bytes and image tokens per page against the previous fixed rendering (slower)")
+    
     document_file = st.file_uploader("Upload a PDF file:")
-    if document_file:
-        # Create uploads folder if it does not already exist
-        if not os.path.exists("uploads"):
-            os.makedirs("uploads")
-        
-        filepath = os.path.join("uploads", document_file.name)
-        with open(filepath, "wb") as f:
-            f.write(document_file.getbuffer())
     
     # Button to submit the file
     if st.button("Submit"):
         if extract_type == "Doc Intelligence":
             st.write("Not yet implemented")
+        elif not document_file:
+            st.warning("Upload a PDF file first.")
         else:
-            with st.spinner("Converting to Images"):
-                image_paths = utils.pdftoimages(filepath)
-            with st.spinner("Extracting text from images"):
-                markdown = ""
-                for image_path in image_paths:
-                    dataurl = utils.create_data_url(image_path)
-                    result = openai_connection.generate_markdown(dataurl)
-                    markdown += result
-            st.write(markdown)
-            # Save the markdown output to a file
-            output_folder = "markdown_output"
-            if not os.path.exists(output_folder):
-                os.makedirs(output_folder)
-            output_filename = os.path.splitext(document_file.name)[0] + "_output.md"
-            output_filepath = os.path.join(output_folder, output_filename)
-            with open(output_filepath, "w", encoding="utf-8") as f:
-                f.write(markdown)
-            st.write(f"Markdown output saved to {output_filepath}")
+            # The upload is only written when it is submitted, and not at all if the same file is already there
+            filepath = utils.save_upload(document_file)
+            # Extraction runs on a background worker, so reruns and refreshes don't interrupt or repeat it
+            options = {
+                "settings": rendering.render_settings(
+                    mode=render_mode,
+                    dpi=render_dpi,
+                    grayscale=render_grayscale,
+                    format=render_format,
+                    quality=render_quality,
+                    max_side=int(render_max_side)),
+                "text_layer": extract_type == "Text layer + GPT 4o",
+                "local_tables": local_tables,
+                "compare_baseline": render_compare,
+            }
+            st.session_state["upload_job_id"] = jobs.submit_job(filepath, os.path.splitext(document_file.name)[0], options)
+    
+    recent_jobs = {job["id"]: job for job in jobs.list_jobs()}
+    if recent_jobs:
+        st.subheader("Extraction jobs")
+        job_ids = list(recent_jobs)
+        current_job_id = st.session_state.get("upload_job_id")
+        job_id = st.selectbox(
+            "Show job:",
+            job_ids,
+            index=job_ids.index(current_job_id) if current_job_id in job_ids else 0,
+            format_func=lambda job_id: f"#{job_id} {recent_jobs[job_id]['name']} ({recent_jobs[job_id]['status']})")
+        st.session_state["upload_job_id"] = job_id
+        job_running = recent_jobs[job_id]["status"] not in jobs.FINISHED_STATUSES
+        
+        # Poll the job while it runs; a full rerun when it finishes stops the polling and shows the results
+        @st.fragment(run_every=2 if job_running else None)
+        def job_progress(job_id):
+            job = jobs.get_job(job_id)
+            # The job is gone if the jobs were cleared from the Home page
+            if job is None or job_running and job["status"] in jobs.FINISHED_STATUSES:
+                st.rerun()
+            if job["status"] == "queued":
+                st.info("Waiting for a free worker...")
+            elif job["pages_total"]:
+                text = f"Extracted {job['pages_done']} of {job['pages_total']} pages"
+                if job["pages_failed"]:
+                    text += f" ({job['pages_failed']} failed)"
+                st.progress(job["pages_done"] / job["pages_total"], text=text)
+            if job_running and job["pages_done"]:
+                with st.expander("Pages extracted so far"):
+                    st.write(extraction.combine_pages(jobs.job_pages(job_id)))
+        
+        job_progress(job_id)
+        
+        job = jobs.get_job(job_id)
+        # The done view only needs page errors and render details; the document itself is read from its output file
+        results = jobs.job_pages(job_id, with_markdown=job["status"] != "done")
+        failures = extraction.failed_pages(results)
+        if job["status"] in jobs.FINISHED_STATUSES and (job["status"] == "failed" or failures):
+            # Pages that were extracted are checkpointed, so a retry only processes the missing ones
+            if st.button("Retry missing pages"):
+                jobs.retry_job(job_id)
+                st.rerun()
+        if job["status"] == "failed":
+            st.error(f"The extraction job failed: {job['error']}")
+            if results:
+                with st.expander(f"Pages extracted before the failure ({len(results)})"):
+                    st.write(extraction.combine_pages(results))
+        elif job["status"] == "done":
+            for failure in failures:
+                st.warning(f"Page {failure['page_number']} could not be extracted: {failure['error']}")
+            rows, totals = rendering.render_report([result["render"] for result in results])
+            vision_pages = sum(1 for row in rows if row["method"] == "vision" and not row.get("checkpointed"))
+            checkpointed_pages = sum(1 for row in rows if row.get("checkpointed"))
+            st.caption(f"{vision_pages} of {len(rows)} pages were sent to the model and {checkpointed_pages} were reused from an earlier run; the rest were converted from the PDF's text layer.")
+            if "baseline_bytes" in totals:
+                st.caption(
+                    f"Sent {totals['bytes'] / 1e6:.2f} MB and about {totals['image_tokens']} image tokens, "
+                    f"against {totals['baseline_bytes'] / 1e6:.2f} MB and {totals['baseline_tokens']} image tokens with the previous fixed rendering.")
+            elif totals:
+                st.caption(f"Sent {totals['bytes'] / 1e6:.2f} MB and about {totals['image_tokens']} image tokens.")
+            with st.expander("Rendering report"):
+                st.dataframe(rows, use_container_width=True)
+            cache_stats = openai_connection.markdown_cache.stats()
+            st.caption(f"Page cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses since the app started ({cache_stats['hit_rate']:.0%} hit rate).")
+            output_path = job["output_path"]
+            if os.path.exists(output_path) and os.path.getmtime(output_path) <= job["finished"]:
+                preview = catalog.read_preview(os.path.basename(output_path), MAX_PREVIEW_CHARS)
+            else:
+                # The output file was deleted, or replaced by a later job with the same name; the job kept its own pages
+                st.warning(f"{output_path} was deleted or replaced by a later upload. Showing the pages saved with this job.")
+                preview = extraction.combine_pages(jobs.job_pages(job_id))[:MAX_PREVIEW_CHARS]
+            st.write(preview)
+            if len(preview) == MAX_PREVIEW_CHARS:
+                st.caption(f"Showing the first {MAX_PREVIEW_CHARS} characters of the document.")
+            st.write(f"Markdown output saved to {job['output_path']}")
             
 elif upload_type == "Image": 
      # File uploader for images
@@ -73,26 +171,13 @@ elif upload_type == "Image":
              # Write the uploaded image to a file
              st.write("Image submitted")
              
-             # Create uploads folder if it does not already exist
-             if not os.path.exists("uploads"):
-                 os.makedirs("uploads")
-             
-             filepath = os.path.join("uploads", document_image.name)
-             with open(filepath, "wb") as f:
-                 f.write(document_image.getbuffer())
-                 
+             filepath = utils.save_upload(document_image)
              dataurl = utils.create_data_url(filepath)
              
              result = openai_connection.generate_markdown(dataurl)
              st.write(result)
              # Save the markdown output to a file
-             output_folder = "markdown_output"
-             if not os.path.exists(output_folder):
-                 os.makedirs(output_folder)
-             output_filename = os.path.splitext(document_image.name)[0] + "_output.md"
-             output_filepath = os.path.join(output_folder, output_filename)
-             with open(output_filepath, "w", encoding="utf-8") as f:
-                 f.write(result)
+             output_filepath = utils.save_markdown_output(os.path.splitext(document_image.name)[0], result, source=document_image.name, page_count=1)
              st.write(f"Markdown output saved to {output_filepath}") 
              
 else:
@@ -104,11 +189,5 @@ else:
     if st.button("Submit"):
         if document_text and document_name:
             # Save the markdown output to a file
-            output_folder = "markdown_output"
-            if not os.path.exists(output_folder):
-                os.makedirs(output_folder)
-            output_filename = document_name+"_output.md"
-            output_filepath = os.path.join(output_folder, output_filename)
-            with open(output_filepath, "w", encoding="utf-8") as f:
-                f.write(document_text)
+            output_filepath = utils.save_markdown_output(document_name, document_text, source="Text input")
             st.write(f"Markdown output saved to {output_filepath}")
\ No newline at end of file
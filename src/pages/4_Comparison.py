@@ -2,16 +2,22 @@
 This Streamlit page provides a user interface for comparing two markdown documents.
 Features:
 - Displays a title and prompt management section for configuring the AI assistant's behavior.
-- Lists available markdown files from the 'markdown_output' directory and allows the user to select two files for comparison.
-- Shows the content of the selected documents side by side in text areas.
+- Lets the user search and page through the document catalog of the 'markdown_output' directory and select two files for comparison.
+- Shows a preview of the start of each selected document in a text area; full documents are only read when compared.
 - On clicking the "Compare" button, sends both documents to an AI-powered comparison function and displays the result.
+- Optionally diffs the documents locally first, sending only the changed regions to the AI or showing the differences without AI.
+- A batch mode compares one document against many, or every pair of selected documents, running the comparisons
+  concurrently and filling in a results table as they complete. Each pair's result is cached by the two documents'
+  content, so re-running a batch only compares the pairs that changed.
 Purpose:
 The purpose of this page is to assist users in analyzing and comparing the content of two markdown documents using AI, highlighting similarities, differences, or other relevant insights.
 """
 
+import itertools
+
 import streamlit as st
 import openai_connection
-import os
+import catalog
 import utils
 
 st.title("Document Comparison")
@@ -23,22 +29,108 @@ with st.expander("Prompt Management", expanded=True):
     utils.prompt_management("comparison", "You are an AI assistant that compares two markdown documents")
 
 
-output_folder = "markdown_output"
-if not os.path.exists(output_folder):
-    os.makedirs(output_folder)
+COMPARE_MODES = {
+    "Full documents": "full",
+    "Changed sections only": "changes",
+    "Mechanical differences (no AI)": "mechanical",
+}
+COMPARE_MODE_HELP = "Changed sections only sends just the differing regions to the AI, which is faster and cheaper for revisions of the same document."
 
-markdown_files = [f for f in os.listdir("markdown_output") if f.endswith(".md")]
-selected_files = st.multiselect("Choose two markdown files to compare:", markdown_files, max_selections=2)
-if len(selected_files) == 2:
-    with open(os.path.join("markdown_output", selected_files[0]), "r", encoding="utf-8") as f:
-        markdown_content_1 = f.read()
-    with open(os.path.join("markdown_output", selected_files[1]), "r", encoding="utf-8") as f:
-        markdown_content_2 = f.read()
-    
-    st.text_area("Document Content 1", markdown_content_1, height=200)
-    st.text_area("Document Content 2", markdown_content_2, height=200)
+batch_mode = st.radio("Documents to compare:", ["Two documents", "One against many", "All pairs"], horizontal=True)
+
+
+def compare_two_documents():
+    column_1, column_2 = st.columns(2)
+    with column_1:
+        document_1 = utils.document_selector("Choose the first markdown file:", "comparison_document_1")
+        if document_1:
+            utils.document_preview(document_1)
+    with column_2:
+        document_2 = utils.document_selector("Choose the second markdown file:", "comparison_document_2")
+        if document_2:
+            utils.document_preview(document_2)
+
+    if document_1 and document_2:
+        compare_mode = st.radio(
+            "Select what to compare:",
+            list(COMPARE_MODES),
+            horizontal=True,
+            help=COMPARE_MODE_HELP)
     
-    if st.button("Compare"):
-        comparison = openai_connection.compare(markdown_content_1, markdown_content_2)
-        st.write(comparison)  
-    
\ No newline at end of file
+        use_cache = st.checkbox("Reuse the previous result if these documents and prompt have been compared before", value=True)
+        if st.button("Compare"):
+            comparison = utils.write_stream(openai_connection.compare(
+                catalog.read(document_1["filename"]),
+                catalog.read(document_2["filename"]),
+                stream=True,
+                mode=COMPARE_MODES[compare_mode],
+                use_cache=use_cache))
+
+
+def compare_batch(one_against_many):
+    if one_against_many:
+        reference = utils.document_selector("Choose the document to compare against the others:", "comparison_reference")
+        if reference:
+            utils.document_preview(reference)
+    # The multiselect lists one page of the catalog; the search narrows it down, e.g. to the versions of one policy
+    query = st.text_input("Search documents", key="comparison_batch_query", placeholder="Filter by file name")
+    catalog.sync()
+    documents = {document["filename"]: document for document in catalog.search(query, limit=1000)}
+    # Documents chosen under an earlier search stay selectable
+    for filename in st.session_state.get("comparison_batch_documents", []):
+        if filename not in documents and catalog.get(filename):
+            documents[filename] = catalog.get(filename)
+    selected = st.multiselect("Choose the documents to compare:", list(documents), key="comparison_batch_documents")
+    selected_documents = [documents[filename] for filename in selected]
+
+    if one_against_many:
+        if not reference:
+            return
+        pairs = [(reference, document) for document in selected_documents if document["filename"] != reference["filename"]]
+    else:
+        pairs = list(itertools.combinations(selected_documents, 2))
+    if not pairs:
+        return
+
+    compare_mode = st.radio("Select what to compare:", list(COMPARE_MODES), horizontal=True, help=COMPARE_MODE_HELP)
+    use_cache = st.checkbox("Reuse previous results for pairs of documents that have been compared before with this prompt", value=True)
+    if not st.button(f"Compare {len(pairs)} pairs"):
+        return
+
+    # Worker threads have no session state, so the prompt is read here and passed to each comparison
+    system_prompt = st.session_state.get("comparison_prompt", "You are an AI assistant that compares two markdown documents")
+
+    def compare_pair(pair):
+        document_1, document_2 = pair
+        return openai_connection.compare_pair(
+            document_1["content_hash"],
+            document_2["content_hash"],
+            lambda: (catalog.read(document_1["filename"]), catalog.read(document_2["filename"])),
+            system_prompt,
+            mode=COMPARE_MODES[compare_mode],
+            use_cache=use_cache)
+
+    rows = [{"Document 1": document_1["filename"], "Document 2": document_2["filename"], "Status": "pending", "Result": ""} for document_1, document_2 in pairs]
+    progress = st.progress(0.0, text=f"0 of {len(pairs)} pairs compared")
+    table = st.empty()
+    table.dataframe(rows, use_container_width=True, hide_index=True)
+    results = [None] * len(pairs)
+    for completed, (index, result, error) in enumerate(utils.run_in_parallel(compare_pair, pairs, max_workers=openai_connection.MAX_CONCURRENT_REQUESTS), start=1):
+        if error is None:
+            results[index] = result
+            rows[index].update({"Status": "done", "Result": result.strip().splitlines()[0][:200] if result.strip() else ""})
+        else:
+            rows[index].update({"Status": "failed", "Result": f"{type(error).__name__}: {error}"})
+        progress.progress(completed / len(pairs), text=f"{completed} of {len(pairs)} pairs compared")
+        table.dataframe(rows, use_container_width=True, hide_index=True)
+
+    for (document_1, document_2), result in zip(pairs, results):
+        if result is not None:
+            with st.expander(f"{document_1['filename']} vs {document_2['filename']}"):
+                st.markdown(result)
+
+
+if batch_mode == "Two documents":
+    compare_two_documents()
+else:
+    compare_batch(batch_mode == "One against many")
@@ -8,6 +8,11 @@ Features:
 - Displays the conversation in the main panel.
 - Displays the current JSON structure in a side panel.
 - Uses OpenAI's API to process user inputs and update the JSON structure.
+- Sends past assistant turns as their conversational text only and the collected information once, in the system
+  prompt, so requests don't grow with repeated JSON snapshots; the size of the last request is shown against the
+  chat history budget.
+- Optionally has the model return only JSON Patch-style updates to the fields that changed, which are validated
+  against the template and merged locally, instead of the whole JSON structure on every turn.
 Dependencies:
 - streamlit
 - openai_connection (custom module for OpenAI API interaction)
@@ -54,14 +59,7 @@ JSON_STRUCTURE_TEMPLATE = {
     }
 }
 
-st.subheader("Information Gathering")
-
-# Initialize chat history and JSON structure if they don't exist in session state
-if "info_gather_messages" not in st.session_state:
-    st.session_state.info_gather_messages = []
-    st.session_state.info_gather_messages.append({
-        "role": "system", 
-        "content": f"""You are an assistant designed to gather information from users. 
+FULL_JSON_PROMPT = f"""You are an assistant designed to gather information from users. 
         Your goal is to extract structured information and build a JSON object according to this template:
         {json.dumps(JSON_STRUCTURE_TEMPLATE, indent=2)}
         
@@ -94,10 +92,66 @@ if "info_gather_messages" not in st.session_state:
         }}
         
         The JSON structure should be built incrementally based on user inputs.
+        Make sure the message_to_user is conversational and friendly, and includes follow-up questions.
+        Guide the user through filling out each section of the template.
+        Don't ask for all information at once - ask one or two questions at a time.
+        Earlier replies in the conversation only show their message_to_user, but every reply must include the complete updated_json.
+        Always return your ENTIRE response as a single valid JSON object that can be parsed."""
+
+# In patch mode the model only returns the fields that changed, so its output stays small however large the template
+# is. The updates are validated against the template and merged locally.
+PATCH_PROMPT = f"""You are an assistant designed to gather information from users. 
+        Your goal is to extract structured information and fill in a JSON object that follows this template:
+        {json.dumps(JSON_STRUCTURE_TEMPLATE, indent=2)}
+        
+        Do not repeat the JSON object. Instead, your entire response should be a valid JSON object with the following structure:
+        {{
+            "message_to_user": "Your conversational message here with follow-up questions",
+            "updates": [LIST OF JSON PATCH OPERATIONS FOR THE FIELDS THAT CHANGED]
+        }}
+        
+        Each update is a JSON Patch operation on a field of the template:
+        - {{"op": "replace", "path": "/section/field", "value": "new value"}} sets a field.
+        - {{"op": "add", "path": "/section/list_field/-", "value": "new item"}} appends an item to a list field.
+        - {{"op": "remove", "path": "/section/field"}} clears a field.
+        Only use paths from the template and update fields one at a time. Use an empty list if nothing changed.
+        
+        For example:
+        
+        {{
+            "message_to_user": "Thanks for sharing your name, John! Could you also tell me your email address so we can keep you updated?",
+            "updates": [{{"op": "replace", "path": "/personal_info/full_name", "value": "John Smith"}}]
+        }}
+        
         Make sure the message_to_user is conversational and friendly, and includes follow-up questions.
         Guide the user through filling out each section of the template.
         Don't ask for all information at once - ask one or two questions at a time.
         Always return your ENTIRE response as a single valid JSON object that can be parsed."""
+
+
+def system_prompt(patch_mode, collected):
+    """
+    Returns the system prompt for the selected response mode, with the information collected so far. Past assistant
+    turns are sent without their JSON, so this is the only copy of the collected information the model sees.
+    """
+    
+    prompt = PATCH_PROMPT if patch_mode else FULL_JSON_PROMPT
+    return f"{prompt}\n\n        Information collected so far:\n        {json.dumps(collected)}"
+
+
+st.subheader("Information Gathering")
+
+patch_mode = st.toggle(
+    "Send field updates only",
+    key="info_gather_patch_mode",
+    help="The model returns only the fields that changed instead of the whole JSON structure, which is much faster for large forms.")
+
+# Initialize chat history and JSON structure if they don't exist in session state
+if "info_gather_messages" not in st.session_state:
+    st.session_state.info_gather_messages = []
+    st.session_state.info_gather_messages.append({
+        "role": "system", 
+        "content": system_prompt(patch_mode, {})
     })
     
     # Store the initial assistant message as a JSON string
@@ -139,21 +193,41 @@ with main_panel:    # Display chat messages from history on app rerun
         with st.chat_message("user"):
             st.markdown(prompt)
         
+        # The system prompt follows the selected mode and carries the information collected so far
+        st.session_state.info_gather_messages[0]["content"] = system_prompt(patch_mode, st.session_state.info_json_structure)
+        
+        # Past assistant turns are sent as their message_to_user text only; chat() adds the new prompt itself
+        history = utils.compact_json_history(st.session_state.info_gather_messages)
+        st.session_state.info_gather_token_report = {
+            "system": utils.message_tokens(history[0]),
+            "conversation": sum(utils.message_tokens(message) for message in history[1:]) + utils.message_tokens({"content": prompt}),
+            "uncompacted": sum(utils.message_tokens(message) for message in st.session_state.info_gather_messages[1:]) + utils.message_tokens({"content": prompt}),
+        }
+        
         # Add user message to chat history
         st.session_state.info_gather_messages.append({"role": "user", "content": prompt})        
 
         # Get model response in JSON format
         with st.spinner("Processing..."):
-            response = openai_connection.chat(prompt, st.session_state.info_gather_messages, response_format='json')
+            response = openai_connection.chat(prompt, history, response_format='json')
         try:
             # Parse the response and extract components
             parsed_response = json.loads(response)
             visible_response = parsed_response.get("message_to_user", "I didn't get that. Could you please try again?")
-            st.session_state.info_json_structure = parsed_response.get("updated_json", {})
+            rejected = []
+            if patch_mode:
+                st.session_state.info_json_structure, rejected = utils.apply_json_patch(
+                    st.session_state.info_json_structure, parsed_response.get("updates", []), JSON_STRUCTURE_TEMPLATE)
+            elif isinstance(parsed_response.get("updated_json"), dict):
+                # Past turns are sent without their updated_json, so a reply may copy them and leave it out; the
+                # information collected so far is then kept rather than reset
+                st.session_state.info_json_structure = parsed_response["updated_json"]
             
             # Display assistant response
             with st.chat_message("assistant"):
                 st.markdown(visible_response)
+                if rejected:
+                    st.caption(f"Ignored {len(rejected)} invalid updates: " + "; ".join(reason for _, reason in rejected))
                 
             # Add assistant response to chat history (store original JSON string)
             st.session_state.info_gather_messages.append({"role": "assistant", "content": response})
@@ -171,6 +245,9 @@ with main_panel:    # Display chat messages from history on app rerun
                 "content": json.dumps({
                     "message_to_user": fallback_message,
                     "updated_json": st.session_state.info_json_structure  # Preserve existing structure
+                } if not patch_mode else {
+                    "message_to_user": fallback_message,
+                    "updates": []
                 })
             })
             
@@ -189,51 +266,32 @@ with json_panel:
     # Option to see raw JSON
     with st.expander("View raw JSON"):
         st.json(st.session_state.info_json_structure)    
+    
+    # Estimated prompt tokens of the last request, against the chat history budget
+    token_report = st.session_state.get("info_gather_token_report")
+    if token_report:
+        sent = token_report["system"] + token_report["conversation"]
+        with st.expander(f"Last request: ~{sent} of {openai_connection.CHAT_HISTORY_TOKENS} tokens"):
+            st.caption(
+                f"System prompt and collected information: ~{token_report['system']} tokens. "
+                f"Conversation: ~{token_report['conversation']} tokens, against ~{token_report['uncompacted']} with the full JSON responses of past turns.")
           # Add a button to reset the information gathering process
     if st.button("Reset Information"):
-        # Keep only the system message and add initial assistant message
-        system_message = next((msg for msg in st.session_state.info_gather_messages if msg["role"] == "system"), None)
-        if system_message:
-            st.session_state.info_gather_messages = [system_message]
-            
-            # Create a string representation of the JSON response
-            reset_message = json.dumps({
-                "message_to_user": "Let's start over! What's your name?", 
-                "updated_json": {}
-            })
-            
-            st.session_state.info_gather_messages.append({
-                "role": "assistant", 
-                "content": reset_message
-            })
-        else:
-            # Reinitialize if system message not found
-            st.session_state.info_gather_messages = []
-            st.session_state.info_gather_messages.append({
-                "role": "system", 
-                "content": f"""You are an assistant designed to gather information from users. 
-                Your goal is to extract structured information and build a JSON object according to this template:
-                {json.dumps(JSON_STRUCTURE_TEMPLATE, indent=2)}
-                
-                Your entire response should be a valid JSON object with the following structure:
-                {{
-                    "message_to_user": "Your conversational message here with follow-up questions",
-                    "updated_json": [COMPLETE JSON STRUCTURE]
-                }}
-                """
-            })
-            
-            # Create a string representation of the JSON response
-            reset_message = json.dumps({
-                "message_to_user": "Hi there! I'll help you fill out some information. Let's start by getting your name. What should I call you?", 
-                "updated_json": {}
-            })
-            
-            st.session_state.info_gather_messages.append({
-                "role": "assistant", 
-                "content": reset_message
-            })
+        # Start again from the system message and the initial assistant message
+        st.session_state.info_gather_messages = [{"role": "system", "content": system_prompt(patch_mode, {})}]
+        
+        # Create a string representation of the JSON response
+        reset_message = json.dumps({
+            "message_to_user": "Let's start over! What's your name?", 
+            "updated_json": {}
+        })
+        
+        st.session_state.info_gather_messages.append({
+            "role": "assistant", 
+            "content": reset_message
+        })
         
         # Reset the JSON structure
         st.session_state.info_json_structure = {}
+        st.session_state.pop("info_gather_token_report", None)
         st.rerun()
\ No newline at end of file
@@ -0,0 +1,62 @@
+"""
+Streamlit Metrics Page
+This Streamlit page shows the latency, token usage, cache hits and errors recorded for the app's model calls and
+PDF rendering since the app process started.
+Features:
+- Summarises each instrumented function with call counts, p50/p95 latency, time to first token and token totals.
+- Shows the hit rates of the response caches.
+- Lists the most recent individual calls.
+- Exports the metrics in the Prometheus text format.
+Dependencies:
+- streamlit
+- metrics (in-process ring buffer of call records)
+- openai_connection (for the response caches)
+Notes:
+- Metrics are shared by all sessions in the app process and are lost when the app restarts.
+"""
+import time
+
+import streamlit as st
+
+import metrics
+import openai_connection
+
+st.title("Metrics")
+st.write("Latency, token usage and errors of the model calls and PDF rendering in this app process. Use this to see whether slowness comes from the model, rasterization or the app itself.")
+
+if st.button("Refresh"):
+    st.rerun()
+
+summary = metrics.summary()
+if summary:
+    st.subheader("Calls by function")
+    st.dataframe(summary, use_container_width=True, hide_index=True)
+else:
+    st.info("No calls have been recorded yet. Use the other pages and come back here.")
+
+st.subheader("Response caches")
+cache_stats = [
+    {"cache": "generate_markdown", **openai_connection.markdown_cache.stats()},
+    {"cache": "question", **openai_connection.question_cache.stats()},
+    {"cache": "comparison", **openai_connection.comparison_cache.stats()},
+]
+st.dataframe(cache_stats, use_container_width=True, hide_index=True)
+
+records = metrics.records()
+if records:
+    with st.expander("Recent calls"):
+        # Timestamps are shown in UTC
+        recent = [
+            {**record, "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(record["timestamp"]))}
+            for record in records[-200:][::-1]
+        ]
+        st.dataframe(recent, use_container_width=True, hide_index=True)
+
+with st.expander("Prometheus export"):
+    prometheus_text = metrics.prometheus_text()
+    st.code(prometheus_text, language="text")
+    st.download_button("Download metrics", prometheus_text, file_name="metrics.prom", mime="text/plain")
+
+if st.button("Reset Metrics"):
+    metrics.reset()
+    st.rerun()
@@ -0,0 +1,51 @@
+"""
+9_Document_QA.py
+This Streamlit page answers questions across all documents that were processed through the Upload Files page.
+Features:
+- Retrieves the passages most relevant to a question from a local BM25 index of the 'markdown_output' documents.
+- Sends only those passages, not whole documents, to the AI model, which answers with numbered citations.
+- Shows the retrieved passages with their document, page and heading so answers can be checked.
+- Optionally restricts the search to selected documents.
+Notes:
+- Indexing and retrieval run locally; only the final answer uses the model.
+"""
+
+import streamlit as st
+import openai_connection
+import catalog
+import search_index
+import utils
+
+SYSTEM_PROMPT = (
+    "You are an AI assistant that answers questions using only the numbered document excerpts provided. "
+    "Cite the excerpts you use as [n]. If the excerpts do not contain the answer, say so."
+)
+
+st.title("Document Q&A")
+st.write("Use this page to ask questions across the documents that were previously uploaded and processed through the Upload Files page. The most relevant passages are found locally and only those are sent to the AI.")
+
+search_index.sync()
+stats = search_index.stats()
+st.caption(f"{stats['documents']} documents indexed in {stats['chunks']} passages ({stats['terms']} distinct terms).")
+
+question = st.text_area("Question:")
+top_k = st.slider("Passages to send to the AI:", min_value=1, max_value=20, value=5)
+filenames = st.multiselect("Only search these documents (optional):", [document["filename"] for document in catalog.search(limit=1000)])
+
+if st.button("Ask") and question.strip():
+    chunks = search_index.search(question, k=top_k, filenames=filenames)
+    if not chunks:
+        st.warning("No passages match the question. Try different keywords.")
+    else:
+        with st.expander(f"Sources ({len(chunks)} passages, ~{sum(utils.estimate_tokens(chunk['text']) for chunk in chunks)} tokens)"):
+            for number, chunk in enumerate(chunks, start=1):
+                location = ", ".join(part for part in (f"page {chunk['page']}" if chunk["page"] else None, chunk["heading"]) if part)
+                st.markdown(f"**[{number}] {chunk['filename']}**" + (f" ({location})" if location else "") + f" - score {chunk['score']}")
+                st.text(chunk["text"])
+
+        excerpts = "\n\n".join(
+            f"[{number}] {chunk['filename']}" + (f", page {chunk['page']}" if chunk["page"] else "") + f"\n{chunk['text']}"
+            for number, chunk in enumerate(chunks, start=1)
+        )
+        prompt = f"Excerpts:\n\n{excerpts}\n\nQuestion: {question}"
+        utils.write_stream(openai_connection.question(prompt, SYSTEM_PROMPT, stream=True))
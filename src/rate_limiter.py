@@ -0,0 +1,89 @@
+"""
+Process-wide rate limiting for model requests.
+Every Streamlit session in the process shares one limiter, so the combined traffic stays within the requests-per-minute
+and tokens-per-minute quotas of the model deployment instead of running into 429 responses.
+"""
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    A pair of token buckets (requests and model tokens) that callers draw from before each request.
+    Waiting callers are served strictly in arrival order, so a session submitting many requests cannot starve others.
+    Args:
+        requests_per_minute (int): The request quota. 0 disables the request limit.
+        tokens_per_minute (int): The model token quota (prompt plus max completion tokens). 0 disables the token limit.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._next_ticket = 0
+        self._serving = 0
+        self._condition = threading.Condition()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def _wait_time(self, tokens, now):
+        waits = [self._paused_until - now]
+        if self.requests_per_minute and self._requests < 1:
+            waits.append((1 - self._requests) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute and self._tokens < tokens:
+            waits.append((tokens - self._tokens) * 60 / self.tokens_per_minute)
+        return max(waits)
+
+    def acquire(self, tokens=0):
+        """
+        Blocks until the request can be sent within both quotas, then deducts it from them.
+        Args:
+            tokens (int, optional): The estimated tokens the request will use. Requests larger than the whole
+                                    per-minute quota are capped to it so they can still run. Defaults to 0.
+        Returns:
+            float: The number of seconds spent waiting.
+        """
+
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+        started = time.monotonic()
+        with self._condition:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if ticket == self._serving:
+                        wait = self._wait_time(tokens, now)
+                        if wait <= 0:
+                            break
+                        self._condition.wait(wait)
+                    else:
+                        self._condition.wait()
+                if self.requests_per_minute:
+                    self._requests -= 1
+                if self.tokens_per_minute:
+                    self._tokens -= tokens
+            finally:
+                self._serving += 1
+                self._condition.notify_all()
+        return time.monotonic() - started
+
+    def pause(self, seconds):
+        """
+        Holds back all waiting and future requests, e.g. after the service has returned Retry-After.
+        Args:
+            seconds (float): How long to pause from now.
+        """
+
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._condition.notify_all()
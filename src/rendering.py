@@ -0,0 +1,254 @@
+"""
+Page rendering for vision extraction.
+Renders PDF pages to compressed images with configurable resolution, colour and encoding, and in adaptive mode picks
+the resolution and the vision `detail` level per page from how much content the page has: text-sparse pages go at
+low detail, dense text and ruled tables at a higher resolution. Also estimates the image tokens each page costs so
+the savings can be reported against the previous fixed rendering.
+Defaults come from the RENDER_* environment variables (see sample.env).
+"""
+import io
+import math
+import os
+
+import metrics
+import utils
+
+DEFAULT_SETTINGS = {
+    "mode": os.getenv("RENDER_MODE", "adaptive"),  # "adaptive" or "fixed"
+    "dpi": int(os.getenv("RENDER_DPI", "72")),  # Normal pages; adaptive mode raises only dense pages to DENSE_DPI
+    "grayscale": os.getenv("RENDER_GRAYSCALE", "false").lower() == "true",
+    "format": os.getenv("RENDER_FORMAT", "jpeg"),  # "jpeg" or "webp"
+    "quality": int(os.getenv("RENDER_QUALITY", "75")),
+    "max_side": int(os.getenv("RENDER_MAX_SIDE", "2048")),
+    "detail": "auto",  # Vision detail level used in fixed mode
+}
+
+# How pages were rendered before rendering was configurable: 72 DPI colour JPEG at PyMuPDF's default quality
+BASELINE_SETTINGS = {"mode": "fixed", "dpi": 72, "grayscale": False, "format": "jpeg", "quality": 95, "max_side": 100000, "detail": "auto"}
+
+# Adaptive mode thresholds
+SPARSE_TEXT_CHARS = 300  # Pages with less text than this and few images are sent at low detail
+SPARSE_MAX_SIDE = 512  # Low detail images are downscaled to 512px by the model, so larger renders are wasted bytes
+DENSE_TEXT_CHARS = 2500  # Pages with more text than this are rendered at up to DENSE_DPI, within the baseline's tiles
+DENSE_DPI = 150
+RULED_LINES = 12  # Pages with at least this many drawn lines and rectangles likely contain a ruled table
+HIGH_DETAIL_SHORT_SIDE = 768  # High detail images are downscaled until their shortest side is 768px, see image_tokens
+
+
+def render_settings(**overrides):
+    """
+    Returns the default render settings with the given values replaced.
+    Args:
+        **overrides: Any of 'mode', 'dpi', 'grayscale', 'format', 'quality', 'max_side' and 'detail'.
+    Returns:
+        dict: The settings.
+    Raises:
+        ValueError: If a setting name, mode or format is not recognised.
+    """
+
+    unknown = set(overrides) - set(DEFAULT_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown render settings: {', '.join(sorted(unknown))}")
+    settings = {**DEFAULT_SETTINGS, **overrides}
+    if settings["mode"] not in ("adaptive", "fixed"):
+        raise ValueError(f"Unknown render mode '{settings['mode']}'")
+    if settings["format"] not in ("jpeg", "webp"):
+        raise ValueError(f"Unknown image format '{settings['format']}'")
+    return settings
+
+
+def profile_page(page):
+    """
+    Measures how much content a page has, using the PDF structure rather than rendering it.
+    Args:
+        page (fitz.Page): The page.
+    Returns:
+        dict: 'text_chars' (characters in the text layer), 'image_coverage' (fraction of the page covered by embedded
+              images, e.g. a scan), 'ruled_lines' (drawn lines and rectangles) and 'density' ('sparse', 'normal' or
+              'dense').
+    """
+
+    page_area = abs(page.rect) or 1
+    text_chars = len(page.get_text("text").strip())
+    image_area = sum(abs(page.rect & info["bbox"]) for info in page.get_image_info())
+    image_coverage = min(1.0, image_area / page_area)
+    ruled_lines = sum(len(drawing["items"]) for drawing in page.get_drawings())
+
+    if ruled_lines >= RULED_LINES or text_chars >= DENSE_TEXT_CHARS:
+        density = "dense"
+    elif text_chars < SPARSE_TEXT_CHARS and image_coverage < 0.25:
+        density = "sparse"
+    else:
+        # Includes scanned pages, which have no text layer but need a readable image
+        density = "normal"
+
+    return {"text_chars": text_chars, "image_coverage": round(image_coverage, 3), "ruled_lines": ruled_lines, "density": density}
+
+
+def plan_page(page, settings):
+    """
+    Chooses how to render a page.
+    Args:
+        page (fitz.Page): The page.
+        settings (dict): Render settings from `render_settings`.
+    Returns:
+        dict: 'dpi', 'max_side', 'detail' and 'density' (None in fixed mode).
+    """
+
+    if settings["mode"] == "fixed":
+        return {"dpi": settings["dpi"], "max_side": settings["max_side"], "detail": settings["detail"], "density": None}
+
+    density = profile_page(page)["density"]
+    if density == "sparse":
+        return {"dpi": min(settings["dpi"], 72), "max_side": min(settings["max_side"], SPARSE_MAX_SIDE), "detail": "low", "density": density}
+    # Pixels beyond what the model keeps after downscaling cost bytes but add no detail
+    model_dpi = HIGH_DETAIL_SHORT_SIDE * 72 / (min(page.rect.width, page.rect.height) or 1)
+    dpi = max(settings["dpi"], _baseline_tile_dpi(page)) if density == "dense" else settings["dpi"]
+    return {"dpi": int(min(dpi, model_dpi)), "max_side": settings["max_side"], "detail": "high", "density": density}
+
+
+def _baseline_tile_dpi(page):
+    # The highest DPI up to DENSE_DPI at which the page costs no more image tokens than the baseline rendering: the
+    # baseline rarely fills its last 512px tiles, so dense pages get the spare pixels without paying for more tiles
+    width, height = page.rect.width, page.rect.height
+    baseline_dpi = BASELINE_SETTINGS["dpi"]
+    baseline_tokens = image_tokens(math.ceil(width * baseline_dpi / 72), math.ceil(height * baseline_dpi / 72))
+    for dpi in range(DENSE_DPI, baseline_dpi, -1):
+        if image_tokens(math.ceil(width * dpi / 72), math.ceil(height * dpi / 72)) <= baseline_tokens:
+            return dpi
+    return baseline_dpi
+
+
+def render_page(page, dpi=72, grayscale=False, image_format="jpeg", quality=75, max_side=2048):
+    """
+    Renders a page to an encoded image in memory.
+    Args:
+        page (fitz.Page): The page.
+        dpi (int, optional): The resolution. Defaults to 72.
+        grayscale (bool, optional): Render a single grey channel instead of RGB. Defaults to False.
+        image_format (str, optional): 'jpeg' or 'webp'. Defaults to 'jpeg'.
+        quality (int, optional): The encoder quality, 1-100. Defaults to 75.
+        max_side (int, optional): The longest side in pixels; the resolution is lowered to fit. Defaults to 2048.
+    Returns:
+        tuple: (image bytes, width, height).
+    """
+
+    import fitz
+
+    zoom = min(dpi / 72, max_side / max(page.rect.width, page.rect.height))
+    colorspace = fitz.csGRAY if grayscale else fitz.csRGB
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=colorspace, alpha=False)
+
+    if image_format == "webp":
+        # PyMuPDF cannot write WebP; Pillow is installed with Streamlit
+        from PIL import Image
+
+        image = Image.frombytes("L" if grayscale else "RGB", (pix.width, pix.height), pix.samples)
+        buffer = io.BytesIO()
+        image.save(buffer, format="WEBP", quality=quality)
+        return buffer.getvalue(), pix.width, pix.height
+
+    return pix.tobytes("jpeg", jpg_quality=quality), pix.width, pix.height
+
+
+def image_tokens(width, height, detail="high"):
+    """
+    Estimates the input tokens the vision model charges for an image.
+    Args:
+        width (int): The image width in pixels.
+        height (int): The image height in pixels.
+        detail (str, optional): 'low', 'high' or 'auto' (counted as 'high'). Defaults to 'high'.
+    Returns:
+        int: 85 tokens for low detail; otherwise 85 plus 170 per 512px tile after the image is scaled to fit within
+             2048x2048 and its shortest side is scaled down to 768px.
+    """
+
+    if detail == "low":
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def render_pdf(pdf_path, settings=None, compare_baseline=False):
+    """
+    Renders each page of a PDF for the vision model, one page at a time.
+    Args:
+        pdf_path (str): The file path to the PDF document.
+        settings (dict, optional): Render settings from `render_settings`. Defaults to DEFAULT_SETTINGS.
+        compare_baseline (bool, optional): Also render each page with BASELINE_SETTINGS to report the bytes and
+                                           tokens saved. This roughly doubles the rendering time. Defaults to False.
+    Yields:
+        dict: For each page in order: 'page_number' (1-based), 'data_url', 'detail', 'density', 'dpi', 'width',
+              'height', 'bytes' and 'image_tokens', plus 'baseline_bytes' and 'baseline_tokens' if compare_baseline.
+    Notes:
+        - The dicts can be passed straight to `extraction.extract_markdown`.
+    """
+
+    import fitz
+
+    settings = settings or DEFAULT_SETTINGS
+    with fitz.open(pdf_path) as pdf_document:
+        for page in pdf_document:
+            yield render_for_vision(page, settings, compare_baseline)
+
+
+def render_for_vision(page, settings, compare_baseline=False):
+    """
+    Renders one page as planned by `plan_page`.
+    Args:
+        page (fitz.Page): The page.
+        settings (dict): Render settings from `render_settings`.
+        compare_baseline (bool, optional): Also measure the page with BASELINE_SETTINGS. Defaults to False.
+    Returns:
+        dict: The rendered page, as yielded by `render_pdf`.
+    """
+
+    with metrics.track("render_page"):
+        plan = plan_page(page, settings)
+        image, width, height = render_page(page, plan["dpi"], settings["grayscale"], settings["format"], settings["quality"], plan["max_side"])
+        rendered = {
+            "page_number": page.number + 1,
+            "data_url": utils.bytes_to_data_url(image, settings["format"]),
+            "detail": plan["detail"],
+            "density": plan["density"],
+            "dpi": plan["dpi"],
+            "width": width,
+            "height": height,
+            "bytes": len(image),
+            "image_tokens": image_tokens(width, height, plan["detail"]),
+        }
+        if compare_baseline:
+            rendered["baseline_bytes"], rendered["baseline_tokens"] = baseline_cost(page)
+    return rendered
+
+
+def baseline_cost(page):
+    """
+    Returns the bytes and image tokens the page cost with the previous fixed rendering (BASELINE_SETTINGS).
+    Returns:
+        tuple: (bytes, image tokens).
+    """
+
+    baseline = BASELINE_SETTINGS
+    image, width, height = render_page(page, baseline["dpi"], baseline["grayscale"], baseline["format"], baseline["quality"], baseline["max_side"])
+    return len(image), image_tokens(width, height, baseline["detail"])
+
+
+def render_report(pages):
+    """
+    Summarises the size of rendered pages, compared with the baseline rendering where it was measured.
+    Args:
+        pages (list of dict): Rendered pages from `render_pdf` or `extraction.pdf_pages`, with or without 'data_url'.
+    Returns:
+        tuple: (rows, totals). rows has one dict per page with how it was extracted (if known), its density, detail,
+               DPI, bytes and image tokens (and baseline bytes and tokens if measured); totals sums bytes and tokens
+               over all pages.
+    """
+
+    columns = ["page_number", "method", "reason", "checkpointed", "density", "detail", "dpi", "bytes", "image_tokens", "baseline_bytes", "baseline_tokens"]
+    rows = [{column: page[column] for column in columns if column in page} for page in pages]
+    totals = {column: sum(row[column] for row in rows) for column in ("bytes", "image_tokens", "baseline_bytes", "baseline_tokens") if rows and all(column in row for row in rows)}
+    return rows, totals
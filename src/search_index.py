@@ -0,0 +1,261 @@
+"""
+Local BM25 retrieval over the documents in 'markdown_output'.
+Documents are split into chunks on page and heading boundaries and added to an inverted index in a SQLite file in the
+'cache' directory as they are saved, so questions across the whole corpus can be answered by sending the model only the
+few most relevant chunks. Indexing and retrieval run entirely offline.
+"""
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+
+import cache
+import catalog
+import utils
+
+INDEX_PATH = os.path.join(cache.CACHE_FOLDER, "search_index.sqlite")
+CHUNK_TOKENS = int(os.getenv("SEARCH_CHUNK_TOKENS", "400"))
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i if in into is it its me my no not of on or our she so "
+    "than that the their them then there these they this to was we were what when where which who why will with you your".split()
+)
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+PAGE_PATTERN = re.compile(r"^Page (\d+)\b", re.MULTILINE)
+HEADING_PATTERN = re.compile(r"^#{1,6}\s+(.+)$", re.MULTILINE)
+
+_synced = False
+_sync_lock = threading.Lock()
+_write_lock = threading.Lock()
+
+
+def _connect():
+    if not os.path.exists(cache.CACHE_FOLDER):
+        os.makedirs(cache.CACHE_FOLDER)
+    connection = sqlite3.connect(INDEX_PATH, timeout=30)
+    connection.executescript(
+        "CREATE TABLE IF NOT EXISTS documents (filename TEXT PRIMARY KEY, content_hash TEXT NOT NULL);"
+        "CREATE TABLE IF NOT EXISTS chunks ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, filename TEXT NOT NULL, position INTEGER NOT NULL, page INTEGER, "
+        "heading TEXT, text TEXT NOT NULL, length INTEGER NOT NULL);"
+        "CREATE INDEX IF NOT EXISTS chunks_filename ON chunks (filename);"
+        "CREATE TABLE IF NOT EXISTS postings ("
+        "term TEXT NOT NULL, chunk_id INTEGER NOT NULL, tf INTEGER NOT NULL, PRIMARY KEY (term, chunk_id)) WITHOUT ROWID;"
+        "CREATE INDEX IF NOT EXISTS postings_chunk ON postings (chunk_id);"
+    )
+    return connection
+
+
+def tokenize(text):
+    """
+    Splits text into lowercase index terms, dropping common English stopwords and single letters.
+    Args:
+        text (str): The text.
+    Returns:
+        list of str: The terms in order, with repeats.
+    """
+
+    return [term for term in TOKEN_PATTERN.findall(text.lower()) if term not in STOPWORDS and (len(term) > 1 or term.isdigit())]
+
+
+def chunk_document(markdown):
+    """
+    Splits a document into retrieval chunks on page and heading boundaries.
+    Args:
+        markdown (str): The document.
+    Returns:
+        list of dict: 'text', 'page' (the page the chunk starts on, if the document has 'Page <n>' markers) and
+                      'heading' (the chunk's first heading, or the last heading before it).
+    """
+
+    chunks = []
+    page, heading = None, None
+    for text in utils.split_markdown(markdown, CHUNK_TOKENS):
+        first_page = PAGE_PATTERN.search(text)
+        first_heading = HEADING_PATTERN.search(text)
+        start_page = int(first_page.group(1)) if first_page and not text[:first_page.start()].strip() else page
+        chunks.append({"text": text, "page": start_page, "heading": first_heading.group(1).strip() if first_heading else heading})
+        # Carry the last page and heading seen into the next chunk
+        pages = PAGE_PATTERN.findall(text)
+        headings = HEADING_PATTERN.findall(text)
+        page = int(pages[-1]) if pages else page
+        heading = headings[-1].strip() if headings else heading
+    return chunks
+
+
+def index_document(filename, markdown, content_hash=None):
+    """
+    Adds a document to the index, replacing any earlier version. Unchanged documents are skipped.
+    Args:
+        filename (str): The file name within 'markdown_output'.
+        markdown (str): The document's content.
+        content_hash (str, optional): The document's content hash, if already known (see `catalog`).
+    """
+
+    # Same hash as the catalog, so `sync` can tell which documents changed
+    content_hash = content_hash or hashlib.sha256(markdown.encode("utf-8")).hexdigest()
+    with _write_lock:
+        connection = _connect()
+        with connection:
+            _replace(connection, filename, markdown, content_hash)
+        connection.close()
+
+
+def _replace(connection, filename, markdown, content_hash):
+    row = connection.execute("SELECT content_hash FROM documents WHERE filename = ?", (filename,)).fetchone()
+    if row is not None and row[0] == content_hash:
+        return
+    _delete(connection, filename)
+    for position, chunk in enumerate(chunk_document(markdown)):
+        terms = Counter(tokenize(chunk["text"]))
+        cursor = connection.execute(
+            "INSERT INTO chunks (filename, position, page, heading, text, length) VALUES (?, ?, ?, ?, ?, ?)",
+            (filename, position, chunk["page"], chunk["heading"], chunk["text"], sum(terms.values())),
+        )
+        connection.executemany(
+            "INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)",
+            [(term, cursor.lastrowid, tf) for term, tf in terms.items()],
+        )
+    connection.execute("INSERT OR REPLACE INTO documents (filename, content_hash) VALUES (?, ?)", (filename, content_hash))
+
+
+def _delete(connection, filename):
+    connection.execute("DELETE FROM postings WHERE chunk_id IN (SELECT id FROM chunks WHERE filename = ?)", (filename,))
+    connection.execute("DELETE FROM chunks WHERE filename = ?", (filename,))
+    connection.execute("DELETE FROM documents WHERE filename = ?", (filename,))
+
+
+def remove_document(filename):
+    """
+    Removes a document from the index.
+    """
+
+    with _write_lock:
+        connection = _connect()
+        with connection:
+            _delete(connection, filename)
+        connection.close()
+
+
+def sync(force=False):
+    """
+    Indexes catalog documents that are missing from the index or have changed, and drops documents that are no longer
+    in the catalog, e.g. files written before the index existed.
+    Args:
+        force (bool, optional): Sync even if this process has already synced once. Defaults to False.
+    """
+
+    global _synced
+    with _sync_lock:
+        if _synced and not force:
+            return
+        catalog.sync(force)
+        with _connect() as connection:
+            indexed = dict(connection.execute("SELECT filename, content_hash FROM documents").fetchall())
+        connection.close()
+
+        documents, offset = [], 0
+        while True:
+            batch = catalog.search(limit=1000, offset=offset)
+            if not batch:
+                break
+            documents += batch
+            offset += len(batch)
+
+        for document in documents:
+            if indexed.get(document["filename"]) != document["content_hash"]:
+                index_document(document["filename"], catalog.read(document["filename"]), document["content_hash"])
+        for filename in set(indexed) - {document["filename"] for document in documents}:
+            remove_document(filename)
+        _synced = True
+
+
+def search(query, k=5, filenames=None):
+    """
+    Returns the chunks that best match a query, ranked by BM25.
+    Args:
+        query (str): The question or keywords.
+        k (int, optional): The number of chunks to return. Defaults to 5.
+        filenames (list of str, optional): Only search these documents. Defaults to all documents.
+    Returns:
+        list of dict: Up to k chunks, best first, with 'filename', 'page', 'heading', 'text' and 'score'.
+    """
+
+    terms = set(tokenize(query))
+    if not terms:
+        return []
+
+    connection = _connect()
+    try:
+        return _search(connection, terms, k, filenames)
+    finally:
+        connection.close()
+
+
+def _search(connection, terms, k, filenames):
+    chunk_count, total_length = connection.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks").fetchone()
+    if not chunk_count:
+        return []
+    average_length = total_length / chunk_count
+
+    placeholders = ",".join("?" * len(terms))
+    document_frequency = dict(connection.execute(
+        f"SELECT term, COUNT(*) FROM postings WHERE term IN ({placeholders}) GROUP BY term", tuple(terms)
+    ).fetchall())
+
+    sql = (
+        f"SELECT p.chunk_id, p.term, p.tf, c.length FROM postings p JOIN chunks c ON c.id = p.chunk_id "
+        f"WHERE p.term IN ({placeholders})"
+    )
+    parameters = tuple(terms)
+    if filenames:
+        sql += f" AND c.filename IN ({','.join('?' * len(filenames))})"
+        parameters += tuple(filenames)
+
+    scores = {}
+    for chunk_id, term, tf, length in connection.execute(sql, parameters):
+        df = document_frequency[term]
+        idf = math.log((chunk_count - df + 0.5) / (df + 0.5) + 1)
+        scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / average_length))
+
+    best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+    results = []
+    for chunk_id, score in best:
+        filename, page, heading, text = connection.execute(
+            "SELECT filename, page, heading, text FROM chunks WHERE id = ?", (chunk_id,)
+        ).fetchone()
+        results.append({"filename": filename, "page": page, "heading": heading, "text": text, "score": round(score, 3)})
+    return results
+
+
+def stats():
+    """
+    Returns the number of indexed documents, chunks and distinct terms.
+    """
+
+    with _connect() as connection:
+        documents = connection.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        chunks = connection.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        terms = connection.execute("SELECT COUNT(DISTINCT term) FROM postings").fetchone()[0]
+    connection.close()
+    return {"documents": documents, "chunks": chunks, "terms": terms}
+
+
+def clear():
+    """
+    Empties the index.
+    """
+
+    if os.path.exists(INDEX_PATH):
+        with _write_lock:
+            connection = _connect()
+            with connection:
+                connection.executescript("DELETE FROM postings; DELETE FROM chunks; DELETE FROM documents;")
+            connection.close()
@@ -1,64 +1,557 @@
-import fitz
 import os
 import base64
+import contextlib
+import copy
+import difflib
+import hashlib
+import json
+import math
+import re
+import tempfile
+import time
 import streamlit as st
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-def pdftoimages(pdf_path):
+import catalog
+import checkpoints
+import metrics
+
+def create_data_url(image_path):
+    """
+    Converts an image file to a data URL containing a base64-encoded representation of the image.
+    Args:
+        image_path (str): The file path to the image.
+    Returns:
+        str: A data URL string in the format 'data:image/<ext>;base64,<base64_data>' suitable for embedding in HTML.
+    Raises:
+        FileNotFoundError: If the specified image file does not exist.
+        Exception: For other issues encountered while reading or encoding the file.
+    Example:
+        data_url = create_data_url('path/to/image.png')
+    """
+    
+    with open(image_path, 'rb') as f:
+        binary_fc = f.read()
+
+    ext= image_path.split('.')[-1]
+    
+    return bytes_to_data_url(binary_fc, ext)
+
+
+def bytes_to_data_url(image_bytes, ext):
+    """
+    Converts encoded image bytes to a base64 data URL.
+    Args:
+        image_bytes (bytes): The encoded image, e.g. JPEG or PNG bytes.
+        ext (str): The image format used in the MIME type (e.g. 'jpeg', 'png').
+    Returns:
+        str: A data URL string in the format 'data:image/<ext>;base64,<base64_data>'.
+    """
+    
+    base64_utf8_str = base64.b64encode(image_bytes).decode('utf-8')
+    return f'data:image/{ext};base64,{base64_utf8_str}'
+
+
+def pdf_page_count(pdf_path):
     """
-    Converts each page of a PDF file into an image and saves them locally.
+    Returns the number of pages in a PDF without rendering any of them.
+    Args:
+        pdf_path (str): The file path to the PDF document.
+    Returns:
+        int: The number of pages.
+    """
+    
+    import fitz
+    
+    with fitz.open(pdf_path) as pdf_document:
+        return len(pdf_document)
+
+
+def pdf_to_data_urls(pdf_path):
+    """
+    Renders each page of a PDF and yields it as a JPEG data URL, one page at a time.
     Args:
         pdf_path (str): The file path to the PDF document to be converted.
+    Yields:
+        str: A data URL for each page, in page order.
+    Notes:
+        - Pages are encoded straight from the pixmap in memory, so no image files are written to disk.
+        - Only the page currently being rendered is held in memory; consume the generator lazily to keep it that way.
+    """
+    
+    import fitz
+    
+    with fitz.open(pdf_path) as pdf_document:
+        for page in pdf_document:
+            with metrics.track("render_page"):
+                pix = page.get_pixmap()
+                dataurl = bytes_to_data_url(pix.tobytes("jpeg"), "jpeg")
+            yield dataurl
+
+
+def run_in_parallel(func, items, max_workers=4, max_ahead=None):
+    """
+    Applies a function to each item using a pool of worker threads, keeping at most max_workers calls in flight.
+    Args:
+        func (callable): The function to call with each item.
+        items (iterable): The inputs to process. Items are pulled lazily, so generators are only consumed as workers free up.
+        max_workers (int, optional): The maximum number of concurrent calls. Defaults to 4.
+        max_ahead (int, optional): Don't start an item max_ahead or more positions after the oldest unfinished one.
+                                   With `in_input_order` this bounds the results held back behind a slow item, at the
+                                   cost of idle workers while it runs. Defaults to None (no limit).
+    Yields:
+        tuple: (index, result, error) for each item as soon as it finishes, so the order may differ from the input
+               order (see `in_input_order`). On success error is None; on failure result is None and error is the
+               exception raised by func.
+    Notes:
+        - A new item is started whenever any call finishes, so one slow item doesn't leave the other workers idle.
+        - Exceptions raised by func are captured per item so one failure does not stop the remaining items.
+        - func runs outside the Streamlit script thread and must not call Streamlit APIs.
+    """
+    
+    max_workers = max(1, int(max_workers))
+    items = iter(enumerate(items))
+    running = {}
+    next_item = None
+
+    def start_items(executor):
+        nonlocal next_item
+        while len(running) < max_workers:
+            if next_item is None:
+                next_item = next(items, None)
+                if next_item is None:
+                    return
+            if max_ahead and running and next_item[0] >= min(running.values()) + max_ahead:
+                return
+            index, item = next_item
+            running[executor.submit(func, item)] = index
+            next_item = None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        start_items(executor)
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield _collect_future(running.pop(future), future)
+            start_items(executor)
+
+
+def _collect_future(index, future):
+    try:
+        return index, future.result(), None
+    except Exception as error:
+        return index, None, error
+
+
+def in_input_order(results):
+    """
+    Puts the results of `run_in_parallel` back into input order.
+    Args:
+        results (iterable of tuple): (index, result, error) tuples in completion order.
+    Yields:
+        tuple: The same tuples in index order, each as soon as it and every earlier one have arrived.
+    Notes:
+        - Results that finish ahead of a slower earlier one are held until it arrives, so use this only where order
+          matters, e.g. for the pages of a document.
+    """
+    
+    waiting = {}
+    next_index = 0
+    for result in results:
+        waiting[result[0]] = result
+        while next_index in waiting:
+            yield waiting.pop(next_index)
+            next_index += 1
+
+
+def estimate_tokens(text):
+    """
+    Estimates the number of model tokens in a piece of text without calling a tokenizer.
+    Args:
+        text (str): The text to measure.
     Returns:
-        list of str: A list containing the file paths of the generated image files.
+        int: The approximate token count, using the rule of thumb of about four characters per token for English text.
+    """
+    
+    return math.ceil(len(text) / 4)
+
+
+# A new section starts at a markdown heading or at the "Page N" line that generate_markdown puts at the top of each page
+SECTION_BOUNDARY = re.compile(r"^(?=#{1,6}\s|Page \d+\b)", re.MULTILINE)
+
+
+def split_markdown(markdown, max_tokens):
+    """
+    Splits markdown into chunks of at most max_tokens (estimated), breaking on page and heading boundaries where possible.
+    Args:
+        markdown (str): The markdown document to split.
+        max_tokens (int): The token budget for each chunk.
+    Returns:
+        list of str: The chunks in document order. Joining them reproduces the original text.
     Notes:
-        - Images are saved in the 'output_images' directory, which is created if it does not exist.
-        - Each image is named using the PDF file name and the page number (e.g., 'document_page0.jpg').
-        - Requires the 'fitz' (PyMuPDF) and 'os' modules.
+        - Consecutive sections are packed into the same chunk while they fit the budget.
+        - Sections larger than the budget are split on blank lines, then on lines, and finally at a fixed character length.
     """
     
-    pdf_document = fitz.open(pdf_path)
-    image_paths = []
+    pieces = []
+    for section in SECTION_BOUNDARY.split(markdown):
+        if section:
+            pieces.extend(_split_oversized(section, max_tokens))
+    
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if current and estimate_tokens(current + piece) > max_tokens:
+            chunks.append(current)
+            current = ""
+        current += piece
+    if current:
+        chunks.append(current)
+    
+    return chunks
 
-    for page_num in range(len(pdf_document)):
-        page = pdf_document.load_page(page_num)
-        pix = page.get_pixmap()
-        
-        # Save image locally
-        output_dir = "output_images"
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-            
-        pdf_name = os.path.splitext(os.path.basename(pdf_path))[0]
-        
-        image_path = os.path.join(output_dir, f'{pdf_name}_page{page_num}.jpg')
-        pix.save(image_path)
+
+def _split_oversized(text, max_tokens):
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+    
+    for separator in ("\n\n", "\n"):
+        parts = text.split(separator)
+        parts = [part + separator for part in parts[:-1]] + [parts[-1]]
+        parts = [part for part in parts if part]
+        if len(parts) > 1:
+            return [piece for part in parts for piece in _split_oversized(part, max_tokens)]
+    
+    max_chars = max_tokens * 4
+    return [text[start:start + max_chars] for start in range(0, len(text), max_chars)]
+
+
+def diff_markdown(markdown1, markdown2, context_lines=2):
+    """
+    Finds the differences between two revisions of a markdown document without calling a model.
+    Sections (split on page and heading boundaries) are aligned first so that unchanged sections are skipped,
+    then the changed sections are compared line by line.
+    Args:
+        markdown1 (str): The first document.
+        markdown2 (str): The second document.
+        context_lines (int, optional): The number of unchanged lines to keep around each change. Defaults to 2.
+    Returns:
+        dict: A dictionary with the keys:
+            - 'identical' (bool): True if the documents have no differences.
+            - 'similarity' (float): The fraction of sections that are unchanged, from 0.0 to 1.0.
+            - 'lines_removed' (int) and 'lines_added' (int): The number of changed lines in each document.
+            - 'regions' (list of dict): One entry per changed region with 'heading' and 'diff' (unified diff text).
+    """
+    
+    sections1 = [section for section in SECTION_BOUNDARY.split(markdown1) if section.strip()]
+    sections2 = [section for section in SECTION_BOUNDARY.split(markdown2) if section.strip()]
+    
+    # Compare sections on their content so that whitespace-only changes don't break the alignment
+    matcher = difflib.SequenceMatcher(
+        None,
+        [" ".join(section.split()) for section in sections1],
+        [" ".join(section.split()) for section in sections2],
+        autojunk=False,
+    )
+    
+    regions = []
+    lines_removed = 0
+    lines_added = 0
+    unchanged_sections = 0
+    for tag, start1, end1, start2, end2 in matcher.get_opcodes():
+        if tag == "equal":
+            unchanged_sections += end1 - start1
+            continue
         
-        image_paths.append(image_path)
+        old_lines = "".join(sections1[start1:end1]).splitlines()
+        new_lines = "".join(sections2[start2:end2]).splitlines()
+        diff_lines = list(difflib.unified_diff(old_lines, new_lines, "Document 1", "Document 2", n=context_lines, lineterm=""))
+        if not diff_lines:
+            continue
         
-    return image_paths
+        lines_removed += sum(1 for line in diff_lines[2:] if line.startswith("-"))
+        lines_added += sum(1 for line in diff_lines[2:] if line.startswith("+"))
+        heading_source = sections1[start1] if start1 < end1 else sections2[start2]
+        regions.append({
+            "heading": heading_source.strip().splitlines()[0][:80],
+            "diff": "\n".join(diff_lines[2:]),
+        })
+    
+    total_sections = max(len(sections1), len(sections2))
+    return {
+        "identical": not regions,
+        "similarity": unchanged_sections / total_sections if total_sections else 1.0,
+        "lines_removed": lines_removed,
+        "lines_added": lines_added,
+        "regions": regions,
+    }
 
 
-def create_data_url(image_path):
+def format_markdown_diff(diff):
     """
-    Converts an image file to a data URL containing a base64-encoded representation of the image.
+    Formats the result of `diff_markdown` as markdown, with one diff block per changed region.
     Args:
-        image_path (str): The file path to the image.
+        diff (dict): The result of `diff_markdown`.
     Returns:
-        str: A data URL string in the format 'data:image/<ext>;base64,<base64_data>' suitable for embedding in HTML.
-    Raises:
-        FileNotFoundError: If the specified image file does not exist.
-        Exception: For other issues encountered while reading or encoding the file.
-    Example:
-        data_url = create_data_url('path/to/image.png')
+        str: A markdown report of the differences.
+    """
+    
+    if diff["identical"]:
+        return "The documents are identical."
+    
+    report = (
+        f"{len(diff['regions'])} changed region(s), {diff['lines_removed']} line(s) removed and "
+        f"{diff['lines_added']} line(s) added. {diff['similarity']:.0%} of sections are unchanged.\n"
+    )
+    for number, region in enumerate(diff["regions"], start=1):
+        report += f"\n#### Change {number}: {region['heading']}\n```diff\n{region['diff']}\n```\n"
+    
+    return report
+
+
+def message_tokens(message):
+    """
+    Estimates the tokens a chat message uses, including a small allowance for the role and message framing.
+    Args:
+        message (dict): A chat message with 'role' and 'content' keys.
+    Returns:
+        int: The approximate token count.
     """
     
-    binary_fc       = open(image_path, 'rb').read()
-    base64_utf8_str = base64.b64encode(binary_fc).decode('utf-8')
+    content = message.get("content") or ""
+    if not isinstance(content, str):
+        content = str(content)
+    
+    return estimate_tokens(content) + 4
 
-    ext= image_path.split('.')[-1]
-    dataurl = f'data:image/{ext};base64,{base64_utf8_str}'
+
+def fit_history(messages, max_tokens):
+    """
+    Trims a conversation to a token budget, keeping every system message and the most recent turns that fit.
+    Args:
+        messages (list): Message dictionaries with 'role' and 'content' keys, oldest first. The last message is always kept.
+        max_tokens (int): The token budget for the whole conversation.
+    Returns:
+        tuple: (kept, dropped) where kept is the list of messages to send, in their original order, and dropped is the
+               list of older non-system messages that did not fit.
+    """
+    
+    system_messages = [message for message in messages[:-1] if message["role"] == "system"]
+    turns = [message for message in messages[:-1] if message["role"] != "system"]
+    
+    budget = max_tokens - sum(message_tokens(message) for message in system_messages) - message_tokens(messages[-1])
+    first_kept = len(turns)
+    while first_kept > 0 and message_tokens(turns[first_kept - 1]) <= budget:
+        budget -= message_tokens(turns[first_kept - 1])
+        first_kept -= 1
+    
+    dropped = turns[:first_kept]
+    dropped_ids = {id(message) for message in dropped}
+    kept = [message for message in messages if id(message) not in dropped_ids]
+    
+    return kept, dropped
+
+
+def compact_json_history(messages, text_key="message_to_user"):
+    """
+    Shrinks a conversation whose assistant turns are stored as raw JSON responses, keeping only their conversational text.
+    Args:
+        messages (list): Message dictionaries with 'role' and 'content' keys, oldest first.
+        text_key (str, optional): The key of the conversational text in the assistant's JSON responses. Defaults to
+                                  "message_to_user".
+    Returns:
+        list: A new list of messages. Assistant turns that parse as JSON objects with text_key are replaced by a JSON
+              object holding only that text; other messages are passed through unchanged.
+    Notes:
+        - Structured data returned on earlier turns (e.g. snapshots of a form) is stale by the next turn, so the caller
+          should send the current data once, e.g. in the system prompt, instead.
+        - The text is kept wrapped in JSON so the earlier turns still show the model the response format.
+    """
     
-    return dataurl
+    compacted = []
+    for message in messages:
+        if message["role"] == "assistant":
+            try:
+                parsed = json.loads(message["content"])
+            except (TypeError, ValueError):
+                parsed = None
+            if isinstance(parsed, dict) and text_key in parsed:
+                message = {"role": "assistant", "content": json.dumps({text_key: parsed[text_key]})}
+        compacted.append(message)
+    return compacted
+
+
+def write_stream(stream):
+    """
+    Renders a stream of response text deltas incrementally and reports the time to first token.
+    Args:
+        stream (iterable of str): The deltas to render, e.g. from `openai_connection.chat(..., stream=True)`.
+    Returns:
+        str: The complete response text, assembled from the deltas, for storing in chat history.
+    Side Effects:
+        - Writes the response and a caption with the time to first token and total time to the Streamlit UI.
+    """
+    
+    started = time.perf_counter()
+    timings = {}
+    
+    def timed_stream():
+        for delta in stream:
+            if "first_token" not in timings:
+                timings["first_token"] = time.perf_counter() - started
+            yield delta
+    
+    text = st.write_stream(timed_stream())
+    if "first_token" in timings:
+        st.caption(f"Time to first token: {timings['first_token']:.2f}s, total: {time.perf_counter() - started:.2f}s")
+    
+    return text if isinstance(text, str) else "".join(str(part) for part in text)
+
+
+def save_upload(uploaded_file, folder="uploads"):
+    """
+    Writes an uploaded file to disk, unless a file with the same name and content is already there.
+    Args:
+        uploaded_file (UploadedFile): The file from `st.file_uploader`.
+        folder (str, optional): The folder to write to. Defaults to 'uploads'.
+    Returns:
+        str: The path of the file on disk.
+    Notes:
+        - The file is written to a temporary name and then renamed, so a background job still reading an earlier
+          upload with the same name keeps reading the complete earlier file.
+    """
+    
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    filepath = os.path.join(folder, uploaded_file.name)
+    content = uploaded_file.getbuffer()
+    if os.path.exists(filepath) and os.path.getsize(filepath) == content.nbytes and checkpoints.file_hash(filepath) == hashlib.sha256(content).hexdigest():
+        return filepath
+    with _replacing(filepath, "wb") as f:
+        f.write(content)
+    return filepath
+
+
+def save_markdown_output(name, markdown, source=None, page_count=None):
+    """
+    Saves extracted or entered markdown where the Comparison and Summarization pages look for documents, and records
+    it in the document catalog and the search index.
+    Args:
+        name (str): The document name, e.g. the uploaded file name without its extension.
+        markdown (str): The markdown to save.
+        source (str, optional): Where the document came from, e.g. the uploaded file name.
+        page_count (int, optional): The number of pages in the source document, if known.
+    Returns:
+        str: The path of the saved file, 'markdown_output/<name>_output.md'.
+    """
+    
+    output_filepath = _output_filepath(name)
+    with open(output_filepath, "w", encoding="utf-8") as f:
+        f.write(markdown)
+    _record_markdown_output(output_filepath, markdown, source, page_count)
+    return output_filepath
+
+
+def write_markdown_output(name, pages, source=None, page_count=None):
+    """
+    Saves a document page by page as its pages are extracted, like `save_markdown_output`.
+    Args:
+        name (str): The document name, e.g. the uploaded file name without its extension.
+        pages (iterable of str): The markdown of each page, in order. Consumed lazily; each page is appended to the
+                                 file as it arrives, so the document is never held in memory while it is extracted.
+        source (str, optional): Where the document came from, e.g. the uploaded file name.
+        page_count (int, optional): The number of pages in the source document, if known.
+    Returns:
+        str: The path of the saved file, 'markdown_output/<name>_output.md'.
+    Notes:
+        - Pages are written to a temporary file that replaces the output file when the last page has been written, so
+          the other pages never see a partly extracted document.
+    """
+    
+    output_filepath = _output_filepath(name)
+    with _replacing(output_filepath, "w", encoding="utf-8") as f:
+        for markdown in pages:
+            f.write(markdown)
+    # The catalog and search index need the finished text once; it is small next to the page images
+    with open(output_filepath, "r", encoding="utf-8") as f:
+        _record_markdown_output(output_filepath, f.read(), source, page_count)
+    return output_filepath
+
+
+@contextlib.contextmanager
+def _replacing(filepath, mode, encoding=None):
+    # Each writer gets its own temporary file next to the target, so two jobs writing the same name never share one;
+    # the last to finish replaces the file with its complete content
+    fd, temp_filepath = tempfile.mkstemp(dir=os.path.dirname(filepath) or ".", prefix=os.path.basename(filepath) + ".", suffix=".part")
+    try:
+        with open(fd, mode, encoding=encoding) as f:
+            yield f
+        os.replace(temp_filepath, filepath)
+    except BaseException:
+        os.remove(temp_filepath)
+        raise
+
+
+def _output_filepath(name):
+    output_folder = catalog.DOCUMENT_FOLDER
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+    return os.path.join(output_folder, name + "_output.md")
+
+
+def _record_markdown_output(output_filepath, markdown, source, page_count):
+    output_filename = os.path.basename(output_filepath)
+    catalog.record(output_filename, markdown, source=source, page_count=page_count)
+    import search_index  # Imported here because search_index uses this module's split_markdown
+    
+    search_index.index_document(output_filename, markdown)
+
+
+def document_selector(label, key, page_size=50):
+    """
+    Renders a searchable, paged selector over the document catalog.
+    Only one page of catalog entries is loaded per rerun, so the selector stays fast with many thousands of documents.
+    Args:
+        label (str): The label of the selectbox.
+        key (str): A unique widget key prefix for this selector.
+        page_size (int, optional): The number of documents listed per page. Defaults to 50.
+    Returns:
+        dict or None: The selected document's catalog entry (see `catalog.search`), or None if nothing is selected.
+    """
+    
+    catalog.sync()
+    query = st.text_input("Search documents:", key=f"{key}_query", placeholder="Part of a file name")
+    total = catalog.count(query)
+    page_count = max(1, math.ceil(total / page_size))
+    page = 1
+    if page_count > 1:
+        page = st.number_input(f"Page (of {page_count}):", 1, page_count, key=f"{key}_page")
+    documents = {document["filename"]: document for document in catalog.search(query, page_size, (page - 1) * page_size)}
+    
+    def describe(filename):
+        document = documents[filename]
+        details = [f"{document['tokens']:,} tokens"]
+        if document["page_count"]:
+            details.insert(0, f"{document['page_count']} pages")
+        return f"{filename} ({', '.join(details)})"
+    
+    selected = st.selectbox(label, list(documents), format_func=describe, index=None, key=key, placeholder=f"{total} documents")
+    return documents.get(selected)
+
+
+def document_preview(document, height=200, max_chars=5000):
+    """
+    Shows the start of a catalog document in a read-only text area, reading only that much of the file.
+    Args:
+        document (dict): The catalog entry, e.g. from `document_selector`.
+        height (int, optional): The text area height in pixels. Defaults to 200.
+        max_chars (int, optional): The number of characters to show. Defaults to 5000.
+    """
+    
+    preview = catalog.read_preview(document["filename"], max_chars)
+    st.text_area(document["filename"], preview, height=height, disabled=True)
+    if len(preview) == max_chars:
+        st.caption(f"Showing the first {max_chars:,} characters of {document['size']:,} bytes.")
 
 
 def prompt_management(prompt_type, default_prompt):
@@ -194,3 +687,96 @@ def render_json_section(data, level=3):
                     render_json_section(item, level + 1)
                 else:
                     st.markdown(f"- {item}")
+
+
+def apply_json_patch(data, operations, template):
+    """
+    Applies JSON Patch-style field updates to a JSON structure, accepting only paths that exist in a template.
+    Args:
+        data (dict): The current structure. It is not modified.
+        operations (list of dict): Operations with 'op' ('add', 'replace' or 'remove'), 'path' (a JSON Pointer such as
+                                   '/personal_info/full_name') and, except for 'remove', 'value'. Items are appended to
+                                   a list with 'add' and a path ending in '/-', and addressed by index otherwise.
+        template (dict): The template the structure follows.
+    Returns:
+        tuple: (updated, rejected) - a copy of data with the valid operations applied in order, and a list of
+               (operation, reason) for the operations that were not applied.
+    Notes:
+        - Fields can only be set to values of the template's type: a scalar for "" fields, a list for [] fields.
+          Sections are updated field by field rather than replaced whole.
+        - 'remove' on a field resets it to the template's empty value.
+        - Sections missing from data are created as needed.
+    """
+    
+    updated = copy.deepcopy(data)
+    rejected = []
+    if not isinstance(operations, list):
+        return updated, [(operations, "expected a list of operations")]
+    for operation in operations:
+        try:
+            _apply_json_operation(updated, operation, template)
+        except ValueError as error:
+            rejected.append((operation, str(error)))
+    return updated, rejected
+
+
+def _apply_json_operation(data, operation, template):
+    if not isinstance(operation, dict) or operation.get("op") not in ("add", "replace", "remove"):
+        raise ValueError("'op' must be 'add', 'replace' or 'remove'")
+    op, path = operation["op"], operation.get("path")
+    if not isinstance(path, str) or not path.startswith("/"):
+        raise ValueError("'path' must be a JSON Pointer such as '/section/field'")
+    if op != "remove" and "value" not in operation:
+        raise ValueError(f"'{op}' needs a 'value'")
+    keys = [key.replace("~1", "/").replace("~0", "~") for key in path[1:].split("/")]
+
+    # Check the whole path against the template before changing anything
+    shapes = [template]
+    for key in keys[:-1]:
+        shape = shapes[-1]
+        if not isinstance(shape, dict) or key not in shape:
+            raise ValueError(f"{path} is not in the template")
+        shapes.append(shape[key])
+    parent_shape, key = shapes[-1], keys[-1]
+    if isinstance(parent_shape, dict):
+        if key not in parent_shape:
+            raise ValueError(f"{path} is not in the template")
+        _check_json_value(operation.get("value"), parent_shape[key], path, op)
+    elif isinstance(parent_shape, list):
+        if not (key == "-" and op == "add") and not key.isdigit():
+            raise ValueError(f"{path}: list items are addressed by index, or appended with '/-'")
+    else:
+        raise ValueError(f"{path} is not in the template")
+
+    parent = data
+    for section, shape in zip(keys[:-1], shapes[1:]):
+        child = parent.get(section)
+        if not isinstance(child, type(shape)):
+            child = parent[section] = type(shape)()
+        parent = child
+
+    if isinstance(parent, dict):
+        parent[key] = copy.deepcopy(parent_shape[key]) if op == "remove" else operation["value"]
+    elif key == "-":
+        parent.append(operation["value"])
+    else:
+        index = int(key)
+        if index > len(parent) or (op != "add" and index == len(parent)):
+            raise ValueError(f"{path}: the list has {len(parent)} items")
+        if op == "add":
+            parent.insert(index, operation["value"])
+        elif op == "replace":
+            parent[index] = operation["value"]
+        else:
+            del parent[index]
+
+
+def _check_json_value(value, shape, path, op):
+    if op == "remove":
+        return
+    if isinstance(shape, dict):
+        raise ValueError(f"{path} is a section; update its fields individually")
+    if isinstance(shape, list) and not isinstance(value, list):
+        raise ValueError(f"{path} must be a list")
+    if not isinstance(shape, list) and not isinstance(value, (str, int, float, bool, type(None))):
+        raise ValueError(f"{path} must be a single value")